@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import core
+
+# Alternative implementations of the two external services used by core.py, so the
+# upload-to-card path can be exercised and benchmarked without Gemini / api-ninjas keys and
+# without network jitter. A backend provides:
+#
+#     identify_vehicle(image_bytes) -> (year, make, model, color)
+#     identify_vehicles([image_bytes]) -> [(year, make, model, color) or the exception, per image]
+#     request_car_stats(make, model, year) -> [matches] or None if the request failed
+#
+# Select one with TRADING_CARS_BACKEND:
+#     live    (default) the real services
+#     fake    canned answers after FAKE_IDENTIFY_LATENCY_MS / FAKE_STATS_LATENCY_MS
+#     record  the real services, with every response saved to BACKEND_RECORDING
+#     replay  responses previously saved to BACKEND_RECORDING
+
+DEFAULT_RECORDING = os.path.join("benchmarks", "recordings", "responses.json")
+
+_FAKE_CARS = (
+    ("2019", "Porsche", "911", "#C0C0C0"),
+    ("2021", "Toyota", "Supra", "#FF0000"),
+    ("2016", "Ford", "Mustang", "#0000FF"),
+    ("2020", "Tesla", "Model 3", "#FFFFFF"),
+    ("2018", "BMW", "M3", "#000000"),
+    ("2022", "Honda", "Civic", "#808080"),
+)
+
+_FAKE_STATS = {
+    "drive": "rwd",
+    "class": "sports car",
+    "cylinders": 6,
+    "displacement": 3.0,
+    "fuel_type": "gas",
+    "city_mpg": 18,
+    "highway_mpg": 24,
+    "combination_mpg": 20,
+    "transmission": "a",
+}
+
+
+def _image_key(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _stats_key(make, model, year):
+    return "|".join(
+        " ".join(str(part).split()).lower() for part in (year, make, model)
+    )
+
+
+def _sleep(latency_ms, jitter_ms=0):
+    delay = latency_ms + (random.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0)
+    if delay > 0:
+        time.sleep(delay / 1000)
+
+
+class LiveBackend:
+    def identify_vehicle(self, image_bytes):
+        return core.live_identify_vehicle(image_bytes)
+
+    def identify_vehicles(self, images):
+        return core.live_identify_vehicles(images)
+
+    def request_car_stats(self, make: str, model: str, year: str):
+        return core.live_request_car_stats(make=make, model=model, year=year)
+
+
+class FakeBackend:
+    # deterministic answers (the same image always gets the same car) after a configurable delay
+    def __init__(self, identify_latency_ms=0, stats_latency_ms=0, jitter_ms=0):
+        self.identify_latency_ms = identify_latency_ms
+        self.stats_latency_ms = stats_latency_ms
+        self.jitter_ms = jitter_ms
+
+    def identify_vehicle(self, image_bytes):
+        _sleep(self.identify_latency_ms, self.jitter_ms)
+        return self._pick(image_bytes)
+
+    def identify_vehicles(self, images):
+        # one delay per batch of core.IDENTIFY_BATCH_SIZE, like one Gemini request
+        batches = -(-len(images) // core.IDENTIFY_BATCH_SIZE)
+        for _ in range(batches):
+            _sleep(self.identify_latency_ms, self.jitter_ms)
+        return [self._pick(image_bytes) for image_bytes in images]
+
+    def _pick(self, image_bytes):
+        return _FAKE_CARS[int(_image_key(image_bytes), 16) % len(_FAKE_CARS)]
+
+    def request_car_stats(self, make: str, model: str, year: str):
+        _sleep(self.stats_latency_ms, self.jitter_ms)
+        return [dict(_FAKE_STATS, year=int(year) if str(year).isdigit() else year, make=make, model=model)]
+
+
+class RecordingBackend:
+    # forwards to another backend (live by default) and saves every response for later replay
+    def __init__(self, recording_path=DEFAULT_RECORDING, inner=None):
+        self.recording_path = recording_path
+        self.inner = inner or LiveBackend()
+        self._lock = threading.Lock()
+        self._recording = _load_recording(recording_path)
+
+    def _save(self):
+        directory = os.path.dirname(self.recording_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.recording_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._recording, f, indent=4)
+        os.replace(tmp_path, self.recording_path)
+
+    def identify_vehicle(self, image_bytes):
+        result = self.inner.identify_vehicle(image_bytes)
+        with self._lock:
+            self._recording["identify"][_image_key(image_bytes)] = list(result) if result else None
+            self._save()
+        return result
+
+    def identify_vehicles(self, images):
+        results = self.inner.identify_vehicles(images)
+        with self._lock:
+            for image_bytes, result in zip(images, results):
+                if not isinstance(result, Exception):  # failures aren't worth replaying
+                    self._recording["identify"][_image_key(image_bytes)] = list(result) if result else None
+            self._save()
+        return results
+
+    def request_car_stats(self, make: str, model: str, year: str):
+        matches = self.inner.request_car_stats(make=make, model=model, year=year)
+        if matches is not None:  # failed requests aren't worth replaying
+            with self._lock:
+                self._recording["stats"][_stats_key(make, model, year)] = matches
+                self._save()
+        return matches
+
+
+class ReplayBackend:
+    # serves recorded responses, optionally after a fixed delay to model network latency
+    def __init__(self, recording_path=DEFAULT_RECORDING, identify_latency_ms=0, stats_latency_ms=0):
+        self.identify_latency_ms = identify_latency_ms
+        self.stats_latency_ms = stats_latency_ms
+        self._recording = _load_recording(recording_path)
+
+    def identify_vehicle(self, image_bytes):
+        _sleep(self.identify_latency_ms)
+        return self._replay(image_bytes)
+
+    def identify_vehicles(self, images):
+        _sleep(self.identify_latency_ms)
+        results = []
+        for image_bytes in images:
+            try:
+                results.append(self._replay(image_bytes))
+            except LookupError as e:
+                results.append(e)
+        return results
+
+    def _replay(self, image_bytes):
+        key = _image_key(image_bytes)
+        if key not in self._recording["identify"]:
+            raise LookupError(f"No recorded identification for image {key[:12]}")
+        result = self._recording["identify"][key]
+        return tuple(result) if result else result
+
+    def request_car_stats(self, make: str, model: str, year: str):
+        _sleep(self.stats_latency_ms)
+        return self._recording["stats"].get(_stats_key(make, model, year))
+
+
+def _load_recording(recording_path):
+    if os.path.exists(recording_path):
+        with open(recording_path, "r") as f:
+            recording = json.load(f)
+    else:
+        recording = {}
+    recording.setdefault("identify", {})
+    recording.setdefault("stats", {})
+    return recording
+
+
+def backend_from_env():
+    # returns the backend selected by TRADING_CARS_BACKEND, or None for the live services
+    name = os.getenv("TRADING_CARS_BACKEND", "live").lower()
+    recording_path = os.getenv("BACKEND_RECORDING", DEFAULT_RECORDING)
+    identify_latency_ms = float(os.getenv("FAKE_IDENTIFY_LATENCY_MS", "0"))
+    stats_latency_ms = float(os.getenv("FAKE_STATS_LATENCY_MS", "0"))
+
+    if name == "live":
+        return None
+    if name == "fake":
+        return FakeBackend(
+            identify_latency_ms=identify_latency_ms,
+            stats_latency_ms=stats_latency_ms,
+            jitter_ms=float(os.getenv("FAKE_LATENCY_JITTER_MS", "0")),
+        )
+    if name == "record":
+        return RecordingBackend(recording_path)
+    if name == "replay":
+        return ReplayBackend(
+            recording_path,
+            identify_latency_ms=identify_latency_ms,
+            stats_latency_ms=stats_latency_ms,
+        )
+    raise ValueError(f"Unknown TRADING_CARS_BACKEND: {name!r}")
@@ -1,50 +1,158 @@
-import cv2
-import json
+import argparse
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from collection_store import get_store
+from config import COLLECTION_DIR
+from image_store import image_path_for
 
+# Draws each car's bounding box and label onto a copy of its photo:
+#
+#     python bbox_test.py --workers 8 --previews 640
+#
+# Images are annotated in a process pool, one worker per core by default. Entries without a
+# bounding box are skipped, and so are entries whose annotated copy is newer than the photo,
+# so re-running only annotates what is new. --previews also writes downscaled copies.
 
-def draw_bounding_boxes():
-    # Read metadata
-    collection_dir = "car_collection"
-    metadata_path = os.path.join(collection_dir, "metadata.json")
+ANNOTATED_DIR = os.path.join(COLLECTION_DIR, "annotated")
+PREVIEW_DIR = os.path.join(ANNOTATED_DIR, "previews")
 
-    with open(metadata_path, "r") as f:
-        metadata = json.load(f)
 
-    # Process each image
-    for image_filename, details in metadata.items():
-        # Construct full image path
-        image_path = os.path.join(collection_dir, image_filename)
+def get_bbox(details):
+    # returns (x1, y1, x2, y2), or None if the entry has no usable bounding box
+    try:
+        x1, y1, x2, y2 = (int(details[corner]) for corner in ("x1", "y1", "x2", "y2"))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def _is_up_to_date(output_path, source_mtime):
+    try:
+        return os.path.getmtime(output_path) >= source_mtime
+    except OSError:
+        return False
+
 
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
+def find_annotation_tasks(metadata, preview_size=None):
+    # returns (tasks, skipped): a task is everything a worker needs to annotate one image
+    tasks = []
+    skipped = 0
+    for image_filename, details in metadata.items():
+        bbox = get_bbox(details)
+        if bbox is None:
+            # nothing to draw, so don't resolve (or download) the image
+            skipped += 1
+            continue
+        image_path = image_path_for(image_filename, details)
+        try:
+            source_mtime = os.path.getmtime(image_path)
+        except OSError:
             print(f"Could not read image: {image_path}")
+            skipped += 1
+            continue
+
+        output_path = os.path.join(ANNOTATED_DIR, os.path.basename(image_path))
+        preview_path = os.path.join(PREVIEW_DIR, os.path.basename(image_path)) if preview_size else None
+        if _is_up_to_date(output_path, source_mtime) and (
+            preview_path is None or _is_up_to_date(preview_path, source_mtime)
+        ):
+            skipped += 1
             continue
 
-        # Get bounding box coordinates
-        x1 = int(details["x1"])
-        y1 = int(details["y1"])
-        x2 = int(details["x2"])
-        y2 = int(details["y2"])
+        label = f"{details.get('year', '')} {details.get('make', '')} {details.get('model', '')}".strip()
+        tasks.append((image_path, output_path, preview_path, preview_size, bbox, label))
+    return tasks, skipped
+
+
+def _init_worker():
+    # parallelism comes from the process pool; keep OpenCV from spawning threads in every worker
+    cv2.setNumThreads(1)
+
+
+def annotate_image(task):
+    # runs in a worker process; returns True if the annotated image was written
+    image_path, output_path, preview_path, preview_size, (x1, y1, x2, y2), label = task
+
+    # Read image
+    img = cv2.imread(image_path)
+    if img is None:
+        print(f"Could not read image: {image_path}")
+        return False
+
+    # Draw rectangle
+    color = (0, 255, 0)  # Green in BGR
+    thickness = 2
+    cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
+
+    # Add label
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.8
+    text_color = (255, 255, 255)  # White
+    cv2.putText(img, label, (x1, max(y1 - 10, 20)), font, font_scale, text_color, thickness)
+
+    # Save the annotated image
+    if not cv2.imwrite(output_path, img):
+        print(f"Could not write annotated image: {output_path}")
+        return False
+
+    if preview_path:
+        height, width = img.shape[:2]
+        scale = preview_size / max(height, width)
+        if scale < 1:
+            img = cv2.resize(
+                img, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA
+            )
+        cv2.imwrite(preview_path, img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return True
+
+
+def draw_bounding_boxes(workers=None, preview_size=None):
+    # Read metadata
+    metadata = get_store().load_metadata()
+    tasks, skipped = find_annotation_tasks(metadata, preview_size)
+
+    os.makedirs(ANNOTATED_DIR, exist_ok=True)
+    if preview_size:
+        os.makedirs(PREVIEW_DIR, exist_ok=True)
+
+    start = time.perf_counter()
+    annotated = failed = 0
+    if tasks:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # chunks keep the per-image pickling and IPC overhead low on large collections
+            chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+            for ok in pool.map(annotate_image, tasks, chunksize=chunksize):
+                if ok:
+                    annotated += 1
+                else:
+                    failed += 1
+    elapsed = time.perf_counter() - start
 
-        # Draw rectangle
-        color = (0, 255, 0)  # Green in BGR
-        thickness = 2
-        cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
+    print(
+        f"Annotated {annotated} images, skipped {skipped}, failed {failed} in {elapsed:.1f}s "
+        f"({annotated / elapsed if elapsed else 0:.1f} images/s) -> {ANNOTATED_DIR}"
+    )
+    return annotated
 
-        # Add label
-        label = f"{details['year']} {details['make']} {details['model']}"
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 0.8
-        text_color = (255, 255, 255)  # White
-        cv2.putText(img, label, (x1, y1 - 10), font, font_scale, text_color, thickness)
 
-        # Save the annotated image
-        output_path = os.path.join(collection_dir, f"annotated_{image_filename}")
-        cv2.imwrite(output_path, img)
-        print(f"Saved annotated image to: {output_path}")
+def main():
+    parser = argparse.ArgumentParser(description="Draw bounding boxes onto the collection's photos.")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument(
+        "--previews",
+        type=int,
+        metavar="PX",
+        default=None,
+        help="also write previews downscaled to this many pixels on the long edge",
+    )
+    args = parser.parse_args()
+    draw_bounding_boxes(workers=args.workers, preview_size=args.previews)
 
 
 if __name__ == "__main__":
-    draw_bounding_boxes()
+    main()
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+# End-to-end latency benchmarks for the upload-to-card path, run against a scratch collection
+# and an offline backend (see backends.py), so results don't depend on API keys or network
+# jitter. Run from the repository root:
+#
+#     python benchmarks/bench_pipeline.py --output bench.json
+#     python benchmarks/bench_pipeline.py --baseline bench.json   # exits 1 on regressions
+#
+# Use TRADING_CARS_BACKEND=replay (with BACKEND_RECORDING) to time recorded real responses.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules under test read their configuration at import time
+os.environ.setdefault("TRADING_CARS_BACKEND", "fake")
+SCRATCH_DIR = tempfile.mkdtemp(prefix="trading-cars-bench-")
+os.environ["COLLECTION_DIR"] = os.path.join(SCRATCH_DIR, "car_collection")
+os.chdir(REPO_ROOT)  # card.py loads its templates' assets relative to the repository root
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+import card  # noqa: E402
+import card_cache  # noqa: E402
+import gallery  # noqa: E402
+import pipeline  # noqa: E402
+import thumbnails  # noqa: E402
+from collection_store import CollectionStore  # noqa: E402
+from config import COLLECTION_DIR  # noqa: E402
+
+GALLERY_SIZES = (10, 1000, 10000)
+CARD_RENDER_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+
+def synthetic_photo(seed, size=(2000, 1500), quality=90):
+    # smooth random colour fields compress like real photos (unlike white noise)
+    rng = np.random.default_rng(seed)
+    small = (rng.random((12, 16, 3)) * 255).astype("uint8")
+    image = Image.fromarray(small).resize(size, Image.Resampling.BICUBIC)
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def timed(fn, repeat=1):
+    # returns the per-call durations in seconds
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(name, durations, **params):
+    ordered = sorted(durations)
+    result = {
+        "name": name,
+        "count": len(durations),
+        "total_s": sum(durations),
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000,
+    }
+    result.update(params)
+    print(
+        f"{name:<32} {json.dumps(params):<20} mean {result['mean_ms']:9.3f} ms   "
+        f"p95 {result['p95_ms']:9.3f} ms   total {result['total_s']:8.3f} s",
+        file=sys.stderr,
+    )
+    return result
+
+
+def bench_identification(photos):
+    results = []
+    cold = [timed(lambda p=photo: pipeline.identify_car(p))[0] for photo in photos]
+    results.append(summarize("identify_cold", cold))
+    warm = [timed(lambda p=photo: pipeline.identify_car(p))[0] for photo in photos]
+    results.append(summarize("identify_recognition_cache_hit", warm))
+    return results
+
+
+def bench_stats_merge(count=50):
+    results = []
+    cars = [{"year": "2020", "make": "Bench", "model": f"Model {i}"} for i in range(count)]
+    cold = [timed(lambda c=dict(car): pipeline.add_car_stats(c))[0] for car in cars]
+    results.append(summarize("stats_merge_cold", cold))
+    warm = [timed(lambda c=dict(car): pipeline.add_car_stats(c))[0] for car in cars]
+    results.append(summarize("stats_merge_cache_hit", warm))
+    return results
+
+
+def populate_collection(store, source_image, count):
+    # every car gets its own image file (hard links, so 10k cars don't cost 10k copies)
+    car_infos = []
+    for i in range(count):
+        image_filename = f"bench_{i:06d}.png"
+        image_path = os.path.join(COLLECTION_DIR, image_filename)
+        try:
+            os.link(source_image, image_path)
+        except OSError:
+            shutil.copyfile(source_image, image_path)
+        car_info = {
+            "year": str(2000 + i % 25),
+            "make": ("Porsche", "Toyota", "Ford", "BMW")[i % 4],
+            "model": f"Model {i % 50}",
+            "color": "#336699",
+            "drive": ("awd", "rwd", "fwd")[i % 3],
+            "class": "sports car",
+            "cylinders": 6,
+            "displacement": 3.0,
+            "fuel_type": "gas",
+            "city_mpg": 18,
+            "highway_mpg": 24,
+        }
+        car_infos.append((image_filename, car_info))
+    return [timed(lambda f=f, c=c: store.add_car(f, c))[0] for f, c in car_infos]
+
+
+def render_cards(cars):
+    # renders cards the way frontend.render_gallery_page does: bodies on a thread pool, then
+    # one gallery document
+    with ThreadPoolExecutor(max_workers=CARD_RENDER_WORKERS) as pool:
+        card_bodies = list(
+            pool.map(
+                lambda car: card.find_suitable_card_body(
+                    vehicle_image_path=os.path.join(COLLECTION_DIR, car[0]),
+                    vehicle_details=car[1],
+                ),
+                cars,
+            )
+        )
+    return gallery.render_gallery(
+        card_bodies,
+        drivetrains=[car[1].get("drive") for car in cars],
+        makes=[car[1].get("make") for car in cars],
+    )
+
+
+def bench_card_rendering(store):
+    results = []
+    cars = store.query_cars(limit=50)
+    clear_render_caches()
+    cold = [
+        timed(
+            lambda c=car: card.find_suitable_card(
+                vehicle_image_path=os.path.join(COLLECTION_DIR, c[0]), vehicle_details=c[1]
+            )
+        )[0]
+        for car in cars
+    ]
+    results.append(summarize("find_suitable_card_cold", cold))
+    warm = [
+        timed(
+            lambda c=car: card.find_suitable_card(
+                vehicle_image_path=os.path.join(COLLECTION_DIR, c[0]), vehicle_details=c[1]
+            )
+        )[0]
+        for car in cars
+    ]
+    results.append(summarize("find_suitable_card_cache_hit", warm))
+    return results
+
+
+def clear_render_caches():
+    card_cache.clear_card_cache()
+    shutil.rmtree(thumbnails.THUMBNAIL_DIR, ignore_errors=True)
+    thumbnails._cache_bytes = None
+
+
+def bench_gallery(source_image, sizes, page_size):
+    results = []
+    for size in sizes:
+        db_path = os.path.join(SCRATCH_DIR, f"gallery_{size}.db")
+        store = CollectionStore(db_path)
+        # start every size from an empty collection, so the cold runs really are cold
+        shutil.rmtree(COLLECTION_DIR, ignore_errors=True)
+        os.makedirs(COLLECTION_DIR)
+
+        persistence = populate_collection(store, source_image, size)
+        results.append(summarize("metadata_persist", persistence, cars=size))
+
+        clear_render_caches()
+
+        def first_page():
+            store.count_cars()
+            render_cards(store.query_cars(limit=page_size))
+
+        results.append(summarize("gallery_first_page_cold", timed(first_page), cars=size))
+        results.append(summarize("gallery_first_page_warm", timed(first_page, repeat=5), cars=size))
+
+        def full_gallery():
+            render_cards(store.query_cars())
+
+        clear_render_caches()
+        results.append(summarize("gallery_full_cold", timed(full_gallery), cars=size))
+        results.append(summarize("gallery_full_warm", timed(full_gallery), cars=size))
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    # returns the benchmarks whose mean regressed by more than `tolerance` against the baseline
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    previous = {
+        (r["name"], r.get("cars")): r["mean_ms"] for r in baseline["results"]
+    }
+    regressions = []
+    for result in results:
+        before = previous.get((result["name"], result.get("cars")))
+        if before and result["mean_ms"] > before * (1 + tolerance):
+            regressions.append(
+                f"{result['name']} (cars={result.get('cars')}): "
+                f"{before:.3f} ms -> {result['mean_ms']:.3f} ms"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the upload-to-card path.")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(map(str, GALLERY_SIZES)),
+        help="comma-separated collection sizes for the gallery benchmarks",
+    )
+    parser.add_argument("--photos", type=int, default=20, help="photos for the identification benchmark")
+    parser.add_argument("--page-size", type=int, default=12)
+    parser.add_argument("--output", help="write results as JSON to this file (default: stdout)")
+    parser.add_argument("--baseline", help="previous results to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown vs the baseline (0.2 = 20%%)"
+    )
+    args = parser.parse_args()
+
+    try:
+        os.makedirs(COLLECTION_DIR, exist_ok=True)
+        photos = [synthetic_photo(seed) for seed in range(args.photos)]
+        source_image = os.path.join(SCRATCH_DIR, "source.jpg")
+        with open(source_image, "wb") as f:
+            f.write(synthetic_photo(seed=12345, size=(1280, 960)))
+
+        results = []
+        results += bench_identification(photos)
+        results += bench_stats_merge()
+
+        card_store = CollectionStore(os.path.join(SCRATCH_DIR, "cards.db"))
+        populate_collection(card_store, source_image, 50)
+        results += bench_card_rendering(card_store)
+
+        sizes = [int(size) for size in args.sizes.split(",") if size]
+        results += bench_gallery(source_image, sizes, args.page_size)
+    finally:
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": os.environ["TRADING_CARS_BACKEND"],
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
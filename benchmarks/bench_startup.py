@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Cold-start benchmark for the container entry point: what a scale-to-zero instance pays
+# before it can answer its first request. Every run is a fresh interpreter that imports
+# Streamlit and then runs frontend.py once through Streamlit's AppTest (the same script run a
+# first visitor triggers) against a scratch collection. Run from the repository root:
+#
+#     python benchmarks/bench_startup.py --runs 5 --output startup.json
+#     python benchmarks/bench_startup.py --budget 2.5   # exits 1 if the first render is slower
+#
+# Reported per run (medians across runs in the summary):
+#     framework_import_s  importing Streamlit itself, which `streamlit run` pays before our code
+#     script_import_s     the imports frontend.py triggers, from -X importtime
+#     first_render_s      the first script run, imports included (time to first render)
+#     rerun_s             a second run of the script, for comparison
+# plus the slowest imports of the first run, and any heavy SDK (see HEAVY_MODULES) that got
+# imported before the first identification, which should never happen.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must only load on first use (identification, stats lookups, bulk jobs)
+HEAVY_MODULES = (
+    "google.generativeai",
+    "grpc",
+    "icecream",
+    "streamlit_extras",
+    "pyarrow",
+    "cv2",
+    "boto3",
+)
+
+_MARKER = "### bench_startup: first render"
+
+_CHILD = f"""
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+framework_import_s = time.perf_counter() - start
+before = set(sys.modules)
+print({_MARKER!r}, file=sys.stderr, flush=True)
+start = time.perf_counter()
+app = AppTest.from_file("frontend.py", default_timeout=120).run()
+first_render_s = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+rerun_s = time.perf_counter() - start
+print(json.dumps({{
+    "framework_import_s": framework_import_s,
+    "first_render_s": first_render_s,
+    "rerun_s": rerun_s,
+    "exceptions": [str(e.value) for e in app.exception],
+    "new_modules": sorted(set(sys.modules) - before),
+}}))
+"""
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def seed_collection(collection_dir, cars):
+    # a collection as uploads would leave it: images in the image store, thumbnails on disk
+    if not cars:
+        return
+    script = f"""
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from pipeline import save_car
+for i in range({cars}):
+    small = (np.random.default_rng(i).random((12, 16, 3)) * 255).astype("uint8")
+    buffered = BytesIO()
+    Image.fromarray(small).resize((1280, 960)).save(buffered, format="JPEG", quality=90)
+    save_car(buffered.getvalue(), {{"year": "2020", "make": "Porsche", "model": f"911 #{{i}}", "color": "#336699"}})
+"""
+    env = dict(os.environ, COLLECTION_DIR=collection_dir, TRADING_CARS_BACKEND="fake")
+    subprocess.run([sys.executable, "-c", script], cwd=REPO_ROOT, env=env, check=True)
+
+
+def parse_imports(stderr):
+    # top-level imports after the marker: [(module, cumulative seconds)], slowest first
+    _, _, after = stderr.partition(_MARKER)
+    entries = []
+    for match in _IMPORT_LINE.finditer(after):
+        entries.append((len(match.group(3)), match.group(4), int(match.group(2)) / 1e6))
+    if not entries:
+        return []
+    top_level = min(indent for indent, _, _ in entries)
+    imports = [(name, seconds) for indent, name, seconds in entries if indent == top_level]
+    return sorted(imports, key=lambda item: item[1], reverse=True)
+
+
+def run_once(collection_dir):
+    env = dict(os.environ, COLLECTION_DIR=collection_dir, METRICS_PORT="0")
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    process_s = time.perf_counter() - start
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    imports = parse_imports(completed.stderr)
+
+    new_modules = result.pop("new_modules")
+    result["process_s"] = process_s
+    result["script_import_s"] = sum(seconds for _, seconds in imports)
+    result["slowest_imports"] = [{"module": name, "s": seconds} for name, seconds in imports[:10]]
+    result["heavy_modules"] = [
+        name for name in HEAVY_MODULES if name in new_modules
+    ]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's cold start.")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to time")
+    parser.add_argument("--cars", type=int, default=12, help="cars in the scratch collection")
+    parser.add_argument("--budget", type=float, help="max median first render, in seconds")
+    parser.add_argument("--output", help="write results as JSON to this file (default: stdout)")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.mkdtemp(prefix="trading-cars-startup-")
+    collection_dir = os.path.join(scratch_dir, "car_collection")
+    try:
+        seed_collection(collection_dir, args.cars)
+        runs = []
+        for run in range(args.runs):
+            result = run_once(collection_dir)
+            runs.append(result)
+            print(
+                f"run {run + 1}: first render {result['first_render_s']:.3f} s "
+                f"(script imports {result['script_import_s']:.3f} s), "
+                f"rerun {result['rerun_s']:.3f} s, Streamlit import {result['framework_import_s']:.3f} s",
+                file=sys.stderr,
+            )
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    summary = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ("framework_import_s", "script_import_s", "first_render_s", "rerun_s", "process_s")
+    }
+    heavy_modules = sorted({name for run in runs for name in run["heavy_modules"]})
+    exceptions = sorted({error for run in runs for error in run["exceptions"]})
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cars": args.cars,
+        "summary": summary,
+        "heavy_modules": heavy_modules,
+        "exceptions": exceptions,
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    failed = False
+    for name in heavy_modules:
+        print(f"SLOW START: {name} is imported before the first identification", file=sys.stderr)
+        failed = True
+    for error in exceptions:
+        print(f"ERROR: the first render raised {error}", file=sys.stderr)
+        failed = True
+    if args.budget is not None and summary["first_render_s"] > args.budget:
+        print(
+            f"OVER BUDGET: first render {summary['first_render_s']:.3f} s > {args.budget:.3f} s",
+            file=sys.stderr,
+        )
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import requests
+from PIL import Image
+from logos import LOGO_ASSETS_FILE, LOGO_ICONS_FILE, compile_logos, normalize_make
+
+# Builds the local logo asset pack used by logos.py: downloads every logo listed in
+# logo_icons.json, fits it into a fixed-size transparent square and writes the PNGs as data
+# URIs to logo_assets.json, keyed by normalized make (together with the make aliases). Run
+# once (the Dockerfile does it at image build time):
+#
+#     python build_logos.py
+#
+# Logos that fail to download are left out; those makes keep using the remote URL.
+
+LOGO_SIZE = 96  # px; cards display logos at 32x32 css px, so this covers 3x screens
+
+
+def fetch_logo(session, url):
+    response = session.get(url, timeout=15, headers={"User-Agent": "trading-cars-logo-builder"})
+    response.raise_for_status()
+
+    with Image.open(BytesIO(response.content)) as image:
+        image = image.convert("RGBA")
+        image.thumbnail((LOGO_SIZE, LOGO_SIZE), Image.Resampling.LANCZOS)
+
+    canvas = Image.new("RGBA", (LOGO_SIZE, LOGO_SIZE), (0, 0, 0, 0))
+    canvas.paste(image, ((LOGO_SIZE - image.width) // 2, (LOGO_SIZE - image.height) // 2), image)
+
+    buffered = BytesIO()
+    canvas.save(buffered, format="PNG", optimize=True)
+    return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
+
+
+def build_logo_assets():
+    with open(LOGO_ICONS_FILE, "r") as f:
+        logo_data = json.load(f)
+
+    session = requests.Session()
+
+    def build(item):
+        try:
+            return normalize_make(item["name"]), fetch_logo(session, item["logo"])
+        except Exception as e:
+            print(f"Skipping {item['name']} logo: {e}")
+            return normalize_make(item["name"]), None
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        local_logos = {name: data_uri for name, data_uri in pool.map(build, logo_data) if data_uri}
+
+    assets = compile_logos(logo_data, local_logos)
+    with open(LOGO_ASSETS_FILE, "w") as f:
+        json.dump(assets, f, sort_keys=True, separators=(",", ":"))
+    print(f"Wrote {len(local_logos)}/{len(logo_data)} logos to {LOGO_ASSETS_FILE}")
+    return assets
+
+
+if __name__ == "__main__":
+    build_logo_assets()
@@ -1,42 +1,22 @@
 import base64
-import json
-import streamlit as st
-from PIL import Image
-from core import get_car_stats
-import icecream as ic
+import functools
+import os
+from thumbnails import get_thumbnail_base64
+from card_cache import card_cache_key, get_cached_card, store_card
+from metrics import time_stage
+from logos import logo_for_make, normalize_make
 
 
-# Load logo data once at the start (outside the function)
-@st.cache_data  # Cache the data to avoid reloading on every rerun
-def load_logo_data():
-    with open("logo_icons.json", "r") as f:
-        logo_data = json.load(f)
-    return {item["name"]: item["logo"] for item in logo_data}
-
-
-# Create logo dictionary (cached and shared across all cards)
-logo_dict = load_logo_data()
-
-
-# Function to encode the image as base64 and crop it if coordinates are provided
+# Function to encode the image as base64 and crop it if coordinates are provided.
+# Served from the on-disk thumbnail cache, so the full-size upload is only decoded once.
 def get_cropped_image_base64(
     image_path, x1: int = None, y1: int = None, x2: int = None, y2: int = None
 ):
-    image = Image.open(image_path)
-    if x1 and y1 and x2 and y2:
-        cropped_image = image.crop((x1, y1, x2, y2))
-    else:
-        cropped_image = image
+    return get_thumbnail_base64(image_path, x1=x1, y1=y1, x2=x2, y2=y2)
 
-    from io import BytesIO
 
-    buffered = BytesIO()
-    cropped_image.save(buffered, format="JPEG")
-    encoded_string = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/jpeg;base64,{encoded_string}"
-
-
-# Function to encode an SVG file as a base64 data URI
+# Function to encode an SVG file as a base64 data URI (read once per icon per process)
+@functools.lru_cache(maxsize=None)
 def get_svg_base64(file_path):
     with open(file_path, "rb") as svg_file:
         encoded_string = base64.b64encode(svg_file.read()).decode()
@@ -44,6 +24,30 @@ def get_svg_base64(file_path):
 
 
 def find_suitable_card(vehicle_image_path, vehicle_details):
+    # the card as a standalone HTML document (stylesheet, font and icon included)
+    card_body = find_suitable_card_body(vehicle_image_path, vehicle_details)
+    if card_body is None:
+        return None
+    return card_document(
+        [card_body], drivetrains=[vehicle_details.get("drive")], makes=[vehicle_details.get("make")]
+    )
+
+
+def find_suitable_card_body(vehicle_image_path, vehicle_details):
+    # the card markup only; it relies on CARD_STYLESHEET, drivetrain_icon_css and logo_css being
+    # present in the document. unchanged cards are served from the render cache, so a stable
+    # gallery costs one lookup per card
+    cache_key = card_cache_key(vehicle_image_path, vehicle_details)
+    card_html = get_cached_card(cache_key)
+    if card_html is None:
+        with time_stage("card_render"):
+            card_html = build_card(vehicle_image_path, vehicle_details)
+        if card_html is not None:
+            store_card(cache_key, card_html)
+    return card_html
+
+
+def build_card(vehicle_image_path, vehicle_details):
 
     image_base64 = get_cropped_image_base64(
         image_path=vehicle_image_path,
@@ -79,7 +83,7 @@ def find_suitable_card(vehicle_image_path, vehicle_details):
     ):
 
         try:
-            card_html = basic_trading_card(
+            card_html = basic_card_body(
                 image_base64=image_base64,
                 make=curr_make,
                 model=curr_model,
@@ -90,7 +94,7 @@ def find_suitable_card(vehicle_image_path, vehicle_details):
             print(f"Error building basic card: {str(e)}")
     else:
         try:
-            card_html = trading_card_with_specs(
+            card_html = card_with_specs_body(
                 image_base64=image_base64,
                 make=curr_make,
                 model=curr_model,
@@ -109,90 +113,181 @@ def find_suitable_card(vehicle_image_path, vehicle_details):
     return card_html
 
 
-def basic_trading_card(
+# Shared by every card: included once per document, however many cards it holds. Per-card
+# colors are passed in through the --card-color custom property.
+CARD_FONT_LINK = """
+<!-- Include Roboto font from Google Fonts -->
+<link href="https://fonts.googleapis.com/css2?family=Roboto:wght@400;500;700&display=swap" rel="stylesheet">
+"""
+
+CARD_STYLESHEET = """
+<style>
+    .card {
+        width: 300px;
+        border: 1.5px solid black;
+        border-radius: 4px;
+        overflow: hidden;
+        background-color: white;
+        box-shadow: 0 2px 3px var(--card-color);
+        transition: transform 0.3s ease, box-shadow 0.3s ease;
+        font-family: 'Roboto', sans-serif;
+        position: relative;
+        margin: 10px;
+    }
+    .card:hover {
+        transform: translateY(-5px) scale(1.03);
+        box-shadow: 0 8px 15px var(--card-color);
+    }
+    .card.with-specs:hover {
+        box-shadow: 0 8px 13px var(--card-color);
+    }
+    .card img.main-image {
+        width: 100%;
+        height: 200px;
+        object-fit: cover;
+    }
+    .card-text {
+        padding: 16px;
+        color: #333;
+    }
+    .card.with-specs .card-text {
+        color: black;
+    }
+    .card-text h3 {
+        margin: 0;
+        font-size: 1.25rem;
+        font-weight: 500;
+        color: black
+    }
+    .card.with-specs .card-text h3 {
+        color: inherit;
+    }
+    .card-text p {
+        margin: 8px 0 0;
+        font-size: 0.875rem;
+        color: #666;
+    }
+    .card a {
+        text-decoration: none;
+        color: inherit;
+        display: block;
+    }
+    .logo-container {
+        position: absolute;
+        top: 10px;
+        right: 10px;
+        width: 40px;
+        height: 40px;
+        background: rgba(255, 255, 255, 0.9);
+        border-radius: 4px;
+        box-shadow: 0 2px 4px var(--card-color);
+        display: flex;
+        align-items: center;
+        justify-content: center;
+        overflow: hidden;
+    }
+    .logo-image {
+        width: 80%;
+        height: 80%;
+        background-size: contain;
+        background-repeat: no-repeat;
+        background-position: center;
+    }
+    .specs-section {
+        display: flex;
+        align-items: center;
+        justify-content: center;
+        gap: 16px;
+        margin: 12px 0;
+        color: #333;
+        font-size: 0.875rem;
+    }
+    .drivetrain-info {
+        display: flex;
+        align-items: center;
+        gap: 8px;
+    }
+    .drivetrain-icon {
+        display: inline-block;
+        width: 24px;
+        height: 17px;
+        background-size: contain;
+        background-repeat: no-repeat;
+        background-position: center;
+    }
+    .card.pending .placeholder-image {
+        width: 100%;
+        height: 200px;
+        background-color: #e6e6e6;
+        animation: card-pulse 1.5s ease-in-out infinite;
+    }
+    @keyframes card-pulse {
+        50% { opacity: 0.5; }
+    }
+</style>
+"""
+
+DRIVETRAIN_ICON_DIR = "drivetrain_icons"
+
+
+def drivetrain_icon_css(drivetrains):
+    # one CSS rule per drivetrain in use, so each icon is embedded once per document
+    rules = []
+    for drivetrain in sorted({str(d).upper() for d in drivetrains if d}):
+        icon_path = os.path.join(DRIVETRAIN_ICON_DIR, f"{drivetrain}-dark.svg")
+        if os.path.exists(icon_path):
+            rules.append(
+                f".drivetrain-icon.drivetrain-{drivetrain.lower()} "
+                f"{{ background-image: url('{get_svg_base64(icon_path)}'); }}"
+            )
+    return f"<style>{''.join(rules)}</style>" if rules else ""
+
+
+def logo_css(makes):
+    # one CSS rule per make in use, so each logo (a local data URI when the asset pack is built)
+    # is embedded once per document rather than once per card
+    rules = []
+    for make in sorted({normalize_make(m) for m in makes if m}):
+        logo_url = logo_for_make(make)
+        if logo_url:
+            rules.append(f".logo-image.logo-{make} {{ background-image: url('{logo_url}'); }}")
+    return f"<style>{''.join(rules)}</style>" if rules else ""
+
+
+def card_document(card_bodies, drivetrains=(), makes=()):
+    # wraps card markup into a standalone HTML document
+    return (
+        CARD_FONT_LINK
+        + CARD_STYLESHEET
+        + drivetrain_icon_css(drivetrains)
+        + logo_css(makes)
+        + "".join(card_bodies)
+    )
+
+
+def _logo_html(make):
+    # the logo itself comes from logo_css, shared by every card of that make in the document
+    if not logo_for_make(make):
+        return ""
+    return f"""
+        <div class="logo-container">
+            <span class="logo-image logo-{normalize_make(make)}" role="img" aria-label="{make} logo"></span>
+        </div>
+        """
+
+
+def basic_card_body(
     image_base64,
     make: str,
     model: str,
     year: str,
     vehicle_color: str,
 ):
-    # Get the logo URL for the given make (assuming logo_dict is defined globally)
-    logo_url = logo_dict.get(make, None)
-    logo_html = ""
-    if logo_url:
-        logo_html = f"""
-        <div class="logo-container">
-            <img src="{logo_url}" alt="{make} logo" class="logo-image">
-        </div>
-        """
+    logo_html = _logo_html(make)
 
     # Build the card HTML
-    card_html = f"""
-    <!-- Include Roboto font from Google Fonts -->
-    <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@400;500;700&display=swap" rel="stylesheet">
-    <style>
-        .card {{
-            width: 300px;
-            border: 1.5px solid black;
-            border-radius: 4px;
-            overflow: hidden;
-            background-color: white;
-            box-shadow: 0 2px 3px {vehicle_color};
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-            font-family: 'Roboto', sans-serif;
-            position: relative;
-            margin: 10px;
-        }}
-        .card:hover {{
-            transform: translateY(-5px) scale(1.03);
-            box-shadow: 0 8px 15px {vehicle_color};
-        }}
-        .card img.main-image {{
-            width: 100%;
-            height: 200px;
-            object-fit: cover;
-        }}
-        .card-text {{
-            padding: 16px;
-            color: #333;
-        }}
-        .card-text h3 {{
-            margin: 0;
-            font-size: 1.25rem;
-            font-weight: 500;
-            color: black
-        }}
-        .card-text p {{
-            margin: 8px 0 0;
-            font-size: 0.875rem;
-            color: #666;
-        }}
-        .card a {{
-            text-decoration: none;
-            color: inherit;
-            display: block;
-        }}
-        .logo-container {{
-            position: absolute;
-            top: 10px;
-            right: 10px;
-            width: 40px;
-            height: 40px;
-            background: rgba(255, 255, 255, 0.9);
-            border-radius: 4px;
-            box-shadow: 0 2px 4px {vehicle_color};
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            overflow: hidden;
-        }}
-        .logo-image {{
-            max-width: 80%;
-            max-height: 80%;
-            object-fit: contain;
-        }}
-    </style>
-    <div class="card">
+    return f"""
+    <div class="card" style="--card-color: {vehicle_color}">
         <a href="https://en.wikipedia.org/wiki/{make}_{model}" target="_blank">
             <img src="{image_base64}" alt="Car image" class="main-image">
             {logo_html}
@@ -203,10 +298,22 @@ def basic_trading_card(
         </a>
     </div>
     """
-    return card_html
 
 
-def trading_card_with_specs(
+def pending_card_body(status: str):
+    # placeholder for an upload that is still being identified
+    return f"""
+    <div class="card pending" style="--card-color: #999999">
+        <div class="placeholder-image"></div>
+        <div class="card-text">
+            <h3>Identifying your car...</h3>
+            <p>{status}</p>
+        </div>
+    </div>
+    """
+
+
+def card_with_specs_body(
     image_base64,
     make: str,
     model: str,
@@ -220,22 +327,10 @@ def trading_card_with_specs(
     highway_mpg: str,
     fuel_type: str,
 ):
-    # Get logo URL for the current vehicle make
-    logo_url = logo_dict.get(make, None)
-
-    # Generate logo HTML if available, with a slightly smaller container
-    logo_html = ""
-    if logo_url:
-        logo_html = f"""
-        <div class="logo-container">
-            <img src="{logo_url}" alt="{make} logo" class="logo-image">
-        </div>
-        """
+    logo_html = _logo_html(make)
 
-    # Get the drivetrain SVG icon as a data URI (using the dark version)
-    drivetrain_icon = get_svg_base64(
-        f"./drivetrain_icons/{drivetrain.upper()}-dark.svg"
-    )
+    # the drivetrain icon itself comes from drivetrain_icon_css, shared by every card in the document
+    drivetrain_icon = f'<span class="drivetrain-icon drivetrain-{drivetrain.lower()}" role="img" aria-label="{drivetrain} layout"></span>'
 
     # Build the specs section based on the fuel type
     if fuel_type.lower() == "electricity":
@@ -244,7 +339,7 @@ def trading_card_with_specs(
                 <div class="year">{year}</div>
                 |
                 <div class="drivetrain-info">
-                    <img src="{drivetrain_icon}" alt="{drivetrain} layout" class="drivetrain-icon">
+                    {drivetrain_icon}
                     <span>{drivetrain.upper()}</span>
                 </div>
             </div>
@@ -256,7 +351,7 @@ def trading_card_with_specs(
                 <div class="year">{year}</div>
                 |
                 <div class="drivetrain-info">
-                    <img src="{drivetrain_icon}" alt="{drivetrain} layout" class="drivetrain-icon">
+                    {drivetrain_icon}
                     <span>{drivetrain.upper()}</span>
                 </div>
                 |
@@ -267,90 +362,8 @@ def trading_card_with_specs(
             <p>{fuel_type} - {class_type} - {(city_mpg + highway_mpg) / 2} MPG</p>
         """
 
-    card_html = f"""
-    <!-- Include Roboto font from Google Fonts -->
-    <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@400;500;700&display=swap" rel="stylesheet">
-    <style>
-        .card {{
-            width: 300px;
-            border: 1.5px solid black;
-            border-radius: 4px;
-            overflow: hidden;
-            background-color: white;
-            box-shadow: 0 2px 3px {vehicle_color};
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-            font-family: 'Roboto', sans-serif;
-            position: relative;
-            margin: 10px;
-        }}
-        
-        .card:hover {{
-            transform: translateY(-5px) scale(1.03);
-            box-shadow: 0 8px 13px {vehicle_color};
-        }}
-        .card img.main-image {{
-            width: 100%;
-            height: 200px;
-            object-fit: cover;
-        }}
-        .card-text {{
-            padding: 16px;
-            color: black;
-        }}
-        .card-text h3 {{
-            margin: 0;
-            font-size: 1.25rem;
-            font-weight: 500;
-        }}
-        .card-text p {{
-            margin: 8px 0 0;
-            font-size: 0.875rem;
-            color: #666;
-        }}
-        .card a {{
-            text-decoration: none;
-            color: inherit;
-            display: block;
-        }}
-        .logo-container {{
-            position: absolute;
-            top: 10px;
-            right: 10px;
-            width: 40px;
-            height: 40px;
-            background: rgba(255, 255, 255, 0.9);
-            border-radius: 4px;
-            box-shadow: 0 2px 4px {vehicle_color};
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            overflow: hidden;
-        }}
-        .logo-image {{
-            max-width: 80%;
-            max-height: 80%;
-            object-fit: contain;
-        }}
-        .specs-section {{
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 16px;
-            margin: 12px 0;
-            color: #333;
-            font-size: 0.875rem;
-        }}
-        .drivetrain-info {{
-            display: flex;
-            align-items: center;
-            gap: 8px;
-        }}
-        .drivetrain-icon {{
-            width: 24px;
-            height: auto;
-        }}
-    </style>
-    <div class="card">
+    return f"""
+    <div class="card with-specs" style="--card-color: {vehicle_color}">
         <a href="https://en.wikipedia.org/wiki/{make}_{model}" target="_blank">
             <img src="{image_base64}" alt="Car image" class="main-image">
             {logo_html}
@@ -361,4 +374,51 @@ def trading_card_with_specs(
         </a>
     </div>
     """
-    return card_html
+
+
+def basic_trading_card(
+    image_base64,
+    make: str,
+    model: str,
+    year: str,
+    vehicle_color: str,
+):
+    card_body = basic_card_body(
+        image_base64=image_base64,
+        make=make,
+        model=model,
+        year=year,
+        vehicle_color=vehicle_color,
+    )
+    return card_document([card_body], makes=[make])
+
+
+def trading_card_with_specs(
+    image_base64,
+    make: str,
+    model: str,
+    year: str,
+    vehicle_color: str,
+    drivetrain: str,
+    class_type: str,
+    cylinders: str,
+    displacement: str,
+    city_mpg: str,
+    highway_mpg: str,
+    fuel_type: str,
+):
+    card_body = card_with_specs_body(
+        image_base64=image_base64,
+        make=make,
+        model=model,
+        year=year,
+        vehicle_color=vehicle_color,
+        drivetrain=drivetrain,
+        class_type=class_type,
+        cylinders=cylinders,
+        displacement=displacement,
+        city_mpg=city_mpg,
+        highway_mpg=highway_mpg,
+        fuel_type=fuel_type,
+    )
+    return card_document([card_body], drivetrains=[drivetrain], makes=[make])
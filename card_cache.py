@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from metrics import record_cache
+
+# Cache of rendered card HTML. A card depends only on its metadata entry, its image and the
+# card templates, so it is keyed by a hash of those three. The in-process LRU lives at module
+# level and is therefore shared by every Streamlit session served by this process.
+
+# bump whenever the markup produced by card.py changes, so stale cards are never served
+TEMPLATE_VERSION = 4
+
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "2048"))
+# set to a directory to also persist rendered cards across restarts
+CARD_CACHE_DIR = os.getenv("CARD_CACHE_DIR")
+
+_lock = threading.Lock()
+_cards = OrderedDict()
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def card_cache_key(vehicle_image_path, vehicle_details):
+    stat = os.stat(vehicle_image_path)
+    image_identity = f"{os.path.abspath(vehicle_image_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    details = json.dumps(vehicle_details, sort_keys=True, default=str)
+    raw = f"{TEMPLATE_VERSION}|{image_identity}|{details}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _disk_path(key):
+    return os.path.join(CARD_CACHE_DIR, key[:2], f"{key}.html")
+
+
+def _remember(key, card_html):
+    with _lock:
+        _cards[key] = card_html
+        _cards.move_to_end(key)
+        while len(_cards) > CARD_CACHE_SIZE:
+            _cards.popitem(last=False)
+
+
+def get_cached_card(key):
+    with _lock:
+        card_html = _cards.get(key)
+        if card_html is not None:
+            _cards.move_to_end(key)
+            _stats["hits"] += 1
+    if card_html is not None:
+        record_cache("card", "hit")
+        return card_html
+
+    if CARD_CACHE_DIR:
+        try:
+            with open(_disk_path(key), "r", encoding="utf-8") as f:
+                card_html = f.read()
+        except FileNotFoundError:
+            pass
+        else:
+            _remember(key, card_html)
+            with _lock:
+                _stats["disk_hits"] += 1
+            record_cache("card", "disk_hit")
+            return card_html
+
+    with _lock:
+        _stats["misses"] += 1
+    record_cache("card", "miss")
+    return None
+
+
+def store_card(key, card_html):
+    _remember(key, card_html)
+
+    if CARD_CACHE_DIR:
+        path = _disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(card_html)
+        os.replace(tmp_path, path)
+
+
+def card_cache_stats():
+    # returns hit/miss counters plus the current in-memory size
+    with _lock:
+        return dict(_stats, size=len(_cards))
+
+
+def clear_card_cache():
+    with _lock:
+        _cards.clear()
+        for counter in _stats:
+            _stats[counter] = 0
@@ -0,0 +1,360 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import COLLECTION_DIR
+from storage import PreconditionFailed, get_storage
+
+# SQLite-backed storage for the car collection. The data model is unchanged from
+# metadata.json (image filename -> car_info dict), but each car is a row, so adding a car is a
+# single insert instead of a rewrite of the whole collection, and WAL mode lets concurrent
+# sessions read and write without losing each other's updates.
+#
+# Cars are keyed by an entry key (the legacy image filename for old entries). Their image
+# lives in the content-addressed image store (see image_store.py), and the blobs table keeps
+# the reference counts of those images.
+#
+# With shared storage (STORAGE_URL, see storage.py) several replicas serve one collection.
+# Every change to the cars table is then first appended to a change log in the shared storage,
+# as metadata/log/<sequence number>.json, and the database becomes this replica's copy of
+# that log. Appends are conditional creates: a replica claims the next sequence number only
+# if no other replica has written it yet. If it loses, it applies the change that won and
+# tries the next number, so every replica applies the same changes in the same order without
+# any locking.
+
+DB_FILE = os.path.join(COLLECTION_DIR, "collection.db")
+LEGACY_METADATA_FILE = os.path.join(COLLECTION_DIR, "metadata.json")
+LOG_PREFIX = "metadata/log/"
+# how stale (in seconds) this replica's copy of a shared collection may get between reruns
+METADATA_SYNC_SECONDS = float(os.getenv("METADATA_SYNC_SECONDS", "2"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cars (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_filename TEXT NOT NULL UNIQUE,
+    make TEXT,
+    year TEXT,
+    car_info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cars_make ON cars (make COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS cars_year ON cars (year);
+CREATE TABLE IF NOT EXISTS blobs (
+    path TEXT PRIMARY KEY,
+    mime_type TEXT NOT NULL,
+    refcount INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seq INTEGER NOT NULL
+);
+"""
+
+
+def _log_key(seq):
+    return f"{LOG_PREFIX}{seq:012d}.json"
+
+
+def _apply_change(conn, change):
+    if change["op"] == "add":
+        car_info = change["car_info"]
+        conn.execute(
+            """
+            INSERT INTO cars (image_filename, make, year, car_info) VALUES (?, ?, ?, ?)
+            ON CONFLICT (image_filename) DO UPDATE SET
+                make = excluded.make, year = excluded.year, car_info = excluded.car_info
+            """,
+            (change["key"], car_info.get("make"), str(car_info.get("year")), json.dumps(car_info)),
+        )
+    elif change["op"] == "remove":
+        conn.execute("DELETE FROM cars WHERE image_filename = ?", (change["key"],))
+    elif change["op"] == "rename":
+        conn.execute(
+            "UPDATE cars SET image_filename = ?, car_info = ? WHERE image_filename = ?",
+            (change["new_key"], json.dumps(change["car_info"]), change["key"]),
+        )
+    else:
+        raise ValueError(f"Unknown change {change['op']!r}")
+
+
+class CollectionStore:
+    def __init__(self, db_path=DB_FILE, storage=None):
+        self.db_path = db_path
+        # the shared storage holding the change log, or None if this database is the collection
+        self.shared_storage = storage if storage is not None and storage.shared else None
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._last_sync = 0.0
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, and Streamlit runs each
+        # session's script on its own thread, so every thread gets its own connection
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, change):
+        if self.shared_storage is None:
+            with self._connection() as conn:
+                _apply_change(conn, change)
+            return
+
+        data = json.dumps(change).encode()
+        with self._write_lock:
+            while True:
+                seq = self.sync() + 1
+                try:
+                    self.shared_storage.put(_log_key(seq), data, create_only=True)
+                except PreconditionFailed:
+                    continue  # another replica took this number; catch up and try the next
+                self._apply_logged(seq, change)
+                return
+
+    def _apply_logged(self, seq, change):
+        # applies change number seq, unless another process on this replica already has
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT seq FROM sync_state WHERE id = 1").fetchone()
+            if (row[0] if row else 0) < seq:
+                _apply_change(conn, change)
+                conn.execute(
+                    "INSERT INTO sync_state (id, seq) VALUES (1, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET seq = excluded.seq",
+                    (seq,),
+                )
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def _synced_seq(self) -> int:
+        row = self._connection().execute("SELECT seq FROM sync_state WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def sync(self) -> int:
+        # applies the changes other replicas have logged since the last sync and returns the
+        # last applied sequence number (always 0 for an unshared collection)
+        if self.shared_storage is None:
+            return 0
+        seq = self._synced_seq()
+        for key in self.shared_storage.list(LOG_PREFIX, start_after=_log_key(seq)):
+            next_seq = int(key[len(LOG_PREFIX) :].split(".")[0])
+            self._apply_logged(next_seq, json.loads(self.shared_storage.get(key)))
+            seq = next_seq
+        self._last_sync = time.monotonic()
+        return seq
+
+    def sync_if_stale(self, max_age=METADATA_SYNC_SECONDS):
+        if self.shared_storage is not None and time.monotonic() - self._last_sync >= max_age:
+            self.sync()
+
+    def add_car(self, image_filename: str, car_info: dict) -> int:
+        # inserts (or updates in place) one car and returns its row id
+        self._write({"op": "add", "key": image_filename, "car_info": car_info})
+        row = (
+            self._connection()
+            .execute("SELECT id FROM cars WHERE image_filename = ?", (image_filename,))
+            .fetchone()
+        )
+        return row[0]
+
+    def get_car(self, image_filename: str):
+        row = (
+            self._connection()
+            .execute("SELECT car_info FROM cars WHERE image_filename = ?", (image_filename,))
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def remove_car(self, image_filename: str):
+        self._write({"op": "remove", "key": image_filename})
+
+    def rename_car(self, old_key: str, new_key: str, car_info: dict):
+        # changes an entry's key (keeping its position in the collection) and its car_info
+        self._write({"op": "rename", "key": old_key, "new_key": new_key, "car_info": car_info})
+
+    def cars_without_image_blob(self):
+        # legacy entries whose image still sits in the flat collection directory
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT image_filename, car_info FROM cars "
+                "WHERE json_extract(car_info, '$.image') IS NULL ORDER BY id"
+            )
+            .fetchall()
+        )
+        return [(image_filename, json.loads(car_info)) for image_filename, car_info in rows]
+
+    def add_blob_reference(self, path: str, mime_type: str) -> int:
+        # returns the new reference count; 1 means the blob is new
+        with self._connection() as conn:
+            row = conn.execute(
+                """
+                INSERT INTO blobs (path, mime_type, refcount) VALUES (?, ?, 1)
+                ON CONFLICT (path) DO UPDATE SET refcount = refcount + 1
+                RETURNING refcount
+                """,
+                (path, mime_type),
+            ).fetchone()
+        return row[0]
+
+    def release_blob_reference(self, path: str) -> int:
+        # returns the remaining reference count; the row is dropped when it reaches 0
+        with self._connection() as conn:
+            row = conn.execute(
+                "UPDATE blobs SET refcount = refcount - 1 WHERE path = ? RETURNING refcount",
+                (path,),
+            ).fetchone()
+            if row is None:
+                return 0
+            if row[0] <= 0:
+                conn.execute("DELETE FROM blobs WHERE path = ?", (path,))
+        return max(row[0], 0)
+
+    def query_cars(
+        self,
+        make: str = None,
+        year: str = None,
+        newest_first: bool = True,
+        limit: int = None,
+        offset: int = 0,
+    ):
+        # returns [(image_filename, car_info), ...] in insertion order (or newest first)
+        clauses, params = [], []
+        if make is not None:
+            clauses.append("make = ? COLLATE NOCASE")
+            params.append(make)
+        if year is not None:
+            clauses.append("year = ?")
+            params.append(str(year))
+
+        sql = "SELECT image_filename, car_info FROM cars"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id DESC" if newest_first else " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+
+        rows = self._connection().execute(sql, params).fetchall()
+        return [(image_filename, json.loads(car_info)) for image_filename, car_info in rows]
+
+    def count_cars(self, make: str = None, year: str = None) -> int:
+        clauses, params = [], []
+        if make is not None:
+            clauses.append("make = ? COLLATE NOCASE")
+            params.append(make)
+        if year is not None:
+            clauses.append("year = ?")
+            params.append(str(year))
+
+        sql = "SELECT COUNT(*) FROM cars"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return self._connection().execute(sql, params).fetchone()[0]
+
+    def cars_since(self, last_id: int = 0):
+        # returns [(id, image_filename, car_info), ...] for cars added after row id last_id
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT id, image_filename, car_info FROM cars WHERE id > ? ORDER BY id",
+                (last_id,),
+            )
+            .fetchall()
+        )
+        return [(car_id, image_filename, json.loads(car_info)) for car_id, image_filename, car_info in rows]
+
+    def car_ids(self):
+        # row ids of every car, oldest first
+        return [car_id for (car_id,) in self._connection().execute("SELECT id FROM cars ORDER BY id")]
+
+    def cars_by_ids(self, ids):
+        # returns [(image_filename, car_info), ...] in the order of ids; missing ids are skipped
+        ids = list(ids)
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        rows = (
+            self._connection()
+            .execute(
+                f"SELECT id, image_filename, car_info FROM cars WHERE id IN ({placeholders})", ids
+            )
+            .fetchall()
+        )
+        by_id = {car_id: (image_filename, json.loads(car_info)) for car_id, image_filename, car_info in rows}
+        return [by_id[car_id] for car_id in ids if car_id in by_id]
+
+    def load_metadata(self) -> dict:
+        # the whole collection as the legacy {image_filename: car_info} mapping, oldest first
+        return dict(self.query_cars(newest_first=False))
+
+    def migrate_from_json(self, metadata_file=LEGACY_METADATA_FILE) -> int:
+        # one-shot import of a legacy metadata.json. the file is renamed afterwards so the
+        # import never runs twice. returns the number of cars imported
+        if not os.path.exists(metadata_file):
+            return 0
+
+        with open(metadata_file, "r") as f:
+            metadata = json.load(f)
+
+        if self.shared_storage is not None:
+            # every replica must see the imported cars, so they go through the change log
+            for image_filename, car_info in metadata.items():
+                self.add_car(image_filename, car_info)
+            os.replace(metadata_file, f"{metadata_file}.migrated")
+            print(f"Migrated {len(metadata)} cars from {metadata_file} to the shared collection")
+            return len(metadata)
+
+        with self._connection() as conn:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO cars (image_filename, make, year, car_info)
+                VALUES (?, ?, ?, ?)
+                """,
+                [
+                    (
+                        image_filename,
+                        car_info.get("make"),
+                        str(car_info.get("year")),
+                        json.dumps(car_info),
+                    )
+                    for image_filename, car_info in metadata.items()
+                ],
+            )
+
+        os.replace(metadata_file, f"{metadata_file}.migrated")
+        print(f"Migrated {len(metadata)} cars from {metadata_file} to {self.db_path}")
+        return len(metadata)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_store() -> CollectionStore:
+    # process-wide store, created (migrated from metadata.json, synced with the shared
+    # collection) on first use
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = CollectionStore(storage=get_storage())
+            _default_store.migrate_from_json()
+            _default_store.sync()
+        return _default_store
+
+
+if __name__ == "__main__":
+    # `python collection_store.py` runs the metadata.json migration by hand
+    get_store()
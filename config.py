@@ -0,0 +1,5 @@
+import os
+
+# Directory holding the collection: images, the collection database and the on-disk caches.
+# Overridable so tools such as the benchmarks can run against a scratch collection.
+COLLECTION_DIR = os.getenv("COLLECTION_DIR", "car_collection")
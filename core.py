@@ -1,135 +1,461 @@
+import asyncio
+import json
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-import google.generativeai as genai
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from icecream import ic
+from metrics import record_api_error
+from rate_limit import Overloaded, call_limited, call_limited_async, get_limiter, parse_retry_after
+from image_store import detect_mime_type
 
 load_dotenv()
 
+GEMINI_MODEL = "gemini-2.0-flash"
 
-def identify_vehicle(image_bytes):
+IDENTIFY_INSTRUCTION = """
+You are a car recognition expert. For every photo you are given, identify the main car: its model year, make, model and primary color as a hex code (e.g. #C0C0C0).
+Only capitalize where correct. Do not specify trim level. Answer once per photo, using the photo's number as image_index."""
 
-    # returns "(YEAR,MAKE,MODEL,COLOR)" 4-tuple
+IDENTIFY_WITH_BBOX_INSTRUCTION = IDENTIFY_INSTRUCTION + """
+Also give the upper-left (x1, y1) and lower-right (x2, y2) pixel coordinates of a bounding box surrounding the entire car."""
 
-    genai.configure(api_key=os.environ["GOOGLE_AI_API"])
+# photos sent to Gemini in a single request by identify_vehicles
+IDENTIFY_BATCH_SIZE = int(os.getenv("IDENTIFY_BATCH_SIZE", "8"))
 
-    # Initialize model with system instruction
-    model = genai.GenerativeModel(
-        "gemini-2.0-flash",
-        system_instruction="You are a car recognition expert. Respond ONLY with 'YEAR, MAKE, MODEL, PRIMARY_COLOR_HEX_CODE' of the main car in the photo. Only capitalize where correct. Do not specify trim level.",
-    )
 
-    # Generate content with separate text and image parts
-    response = model.generate_content(
-        [
-            "Identify this car in format: 'YEAR, MAKE, MODEL, PRIMARY_COLOR_HEX_CODE'",
-            {"mime_type": "image/jpeg", "data": image_bytes},
-        ]
-    )
+def _identification_schema(with_bbox):
+    # the model answers with a JSON array matching this schema, one object per photo
+    properties = {
+        "image_index": {"type": "INTEGER"},
+        "year": {"type": "STRING"},
+        "make": {"type": "STRING"},
+        "model": {"type": "STRING"},
+        "color": {"type": "STRING", "description": "primary color hex code, e.g. #C0C0C0"},
+    }
+    required = list(properties)
+    if with_bbox:
+        properties["bbox"] = {
+            "type": "OBJECT",
+            "properties": {corner: {"type": "INTEGER"} for corner in ("x1", "y1", "x2", "y2")},
+            "required": ["x1", "y1", "x2", "y2"],
+        }
+        required.append("bbox")
+    return {
+        "type": "ARRAY",
+        "items": {"type": "OBJECT", "properties": properties, "required": required},
+    }
 
-    # parse LLM response
-    (
-        year,
-        make,
-        model,
-        color_code,
-    ) = map(str.strip, response.text.split(","))
-
-    # make = make.title()  # ensures consistent capitalization
-    # model = model.title()  # ensures consistent capitalization
-
-    return (
-        year,
-        make,
-        model,
-        color_code,
-    )
 
+class IdentificationError(Exception):
+    # a photo the model gave no usable answer for
+    pass
 
-def get_car_stats(make: str, model: str, year: str) -> dict:
-    url = f"https://api.api-ninjas.com/v1/cars?year={year}&make={make}&model={model}"
-    headers = {"X-Api-Key": os.environ.get("API_NINJAS_KEY", "YOUR_API_KEY")}
 
-    response = requests.get(url, headers=headers)
+# Pluggable implementation of the two external services. None means the live Gemini and
+# api-ninjas calls in this module; backends.py provides replay and fake backends, selected with
+# the TRADING_CARS_BACKEND environment variable or set_backend().
+_backend = None
+_backend_configured = False
 
-    if response.status_code == 200:
-        json = response.json()
-        if len(json):
-            return json[0]
-        else:
-            print(
-                "Stat API request succeeded, but returned empty. (make, model, and year not recognized)"
-            )
-    else:
+
+def set_backend(backend):
+    global _backend, _backend_configured
+    _backend = backend
+    _backend_configured = True
+
+
+def get_backend():
+    global _backend, _backend_configured
+    if not _backend_configured:
+        from backends import backend_from_env
+
+        _backend = backend_from_env()
+        _backend_configured = True
+    return _backend
+
+
+# upper bounds on in-flight requests per API key, shared by every caller in the process. the
+# rate limiter (see rate_limit.py) lowers them while an API answers 429 or 5xx
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+STATS_MAX_CONCURRENCY = int(os.getenv("STATS_MAX_CONCURRENCY", "16"))
+# request quotas per API key; 0 turns the request rate limit off
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "2000"))
+STATS_REQUESTS_PER_MINUTE = float(os.getenv("STATS_REQUESTS_PER_MINUTE", "600"))
+
+
+# All async work runs on one long-lived event loop owned by this module. The Gemini SDK
+# caches a single async gRPC client per process and that client is bound to the loop it was
+# first used on, so requests from other loops (and from the sync wrappers) are forwarded here.
+_loop = None
+_loop_lock = threading.Lock()
+_stats_executor = ThreadPoolExecutor(
+    max_workers=STATS_MAX_CONCURRENCY, thread_name_prefix="stats-api"
+)
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="core-event-loop", daemon=True
+            ).start()
+        return _loop
+
+
+async def _on_core_loop(coro):
+    loop = _get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def _run_sync(coro):
+    # blocks the calling thread until the coroutine completes on the core loop
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+_models = {}
+
+
+def _get_model(system_instruction):
+    # configure the SDK and build each model once, instead of on every identification
+    model = _models.get(system_instruction)
+    if model is None:
+        # the SDK (and grpc under it) takes a while to import, so it's loaded on first use
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.environ["GOOGLE_AI_API"])
+        model = _models[system_instruction] = genai.GenerativeModel(
+            GEMINI_MODEL, system_instruction=system_instruction
+        )
+    return model
+
+
+def _parse_car(item, with_bbox):
+    year, make, model, color_code = (str(item[field]).strip() for field in ("year", "make", "model", "color"))
+    if not with_bbox:
+        return (year, make, model, color_code)
+
+    bbox = item.get("bbox") or {}
+    try:
+        x1, y1, x2, y2 = (int(bbox[corner]) for corner in ("x1", "y1", "x2", "y2"))
+    except (KeyError, TypeError, ValueError):
+        print("LLM provided no usable crop coordinates.")
+        return (year, make, model, color_code)
+
+    # Validate bounding box coordinates
+    if x2 <= x1 or y2 <= y1:
         print(
-            f"Request failed with status code {response.status_code}: {response.text}"
+            "LLM provided invalid crop coordinates! x2 must be greater than x1, and y2 must be greater than y1."
         )
-    return {}
+        return (year, make, model, color_code)
+    return (year, make, model, color_code, x1, y1, x2, y2)
 
 
-def identify_vehicle_with_bbox(image_bytes):
-    # returns "(YEAR,MAKE,MODEL,COLOR)" 4-tuple
+def _parse_identifications(text, image_count, with_bbox=False):
+    # returns one entry per photo, in input order: the parsed tuple, or an IdentificationError
+    try:
+        items = json.loads(text)
+    except ValueError as e:
+        items = e
+    if not isinstance(items, list):
+        error = IdentificationError(f"Unparseable response: {text[:200]!r}")
+        return [error] * image_count
 
-    genai.configure(api_key=os.environ["GOOGLE_AI_API"])
+    results = [None] * image_count
+    for item in items:
+        try:
+            index = int(item["image_index"])
+            if 0 <= index < image_count and results[index] is None:
+                results[index] = _parse_car(item, with_bbox)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Skipping malformed identification {item!r}: {e}")
+
+    return [
+        result if result is not None else IdentificationError(f"No identification for photo {index}")
+        for index, result in enumerate(results)
+    ]
+
+
+_STREAMED_FIELD = r'"{}"\s*:\s*"((?:[^"\\]|\\.)*)"'
 
-    # Initialize model with system instruction
-    model = genai.GenerativeModel(
-        "gemini-2.0-flash",
-        system_instruction="""
-You are a car recognition expert. Your response must consist solely of two distinct 4-tuples describing the main car in the image. 
-Firstly (YEAR, MAKE, MODEL, PRIMARY_COLOR_HEX_CODE) and then secondly, upperleft/lowerright bounding box corner coordinates surrounding the entire car, in the tuple form (x1, y1, x2, y2). Only capitalize where correct.""",
-    )
 
-    # Generate content with separate text and image parts
-    response = model.generate_content(
-        [
-            "Identify this car in format: (YEAR, MAKE, MODEL, PRIMARY_COLOR_HEX_CODE), (x1, y1, x2, y2).",
-            {"mime_type": "image/jpeg", "data": image_bytes},
-        ]
+def _streamed_fields(text, fields=("year", "make", "model")):
+    # reads completed string fields out of a partial JSON response; None until all are complete
+    values = []
+    for field in fields:
+        match = re.search(_STREAMED_FIELD.format(field), text)
+        if match is None:
+            return None
+        values.append(json.loads(f'"{match.group(1)}"').strip())
+    return tuple(values)
+
+
+def _gemini_limiter():
+    return get_limiter(
+        "gemini", os.environ.get("GOOGLE_AI_API", ""), GEMINI_REQUESTS_PER_MINUTE, GEMINI_MAX_CONCURRENCY
     )
 
-    print(response.text)
 
-    # Parse LLM response
+def _retry_delay(error):
+    # the delay a Gemini 429 asks for (its RetryInfo detail), in seconds, or None
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+async def _generate(instruction, contents, with_bbox, on_partial=None):
+    # one attempt at a Gemini request; returns the response text. with on_partial, the response
+    # is streamed and on_partial(text so far) called for every chunk.
+    # 429 and 5xx answers are raised as Overloaded, for the rate limiter to back off and retry
     try:
-        # Split the response into the two tuples
-        tuple1, tuple2 = response.text.strip("()").split("), (")
-
-        # Extract values from the first tuple (YEAR, MAKE, MODEL, PRIMARY_COLOR_HEX_CODE)
-        year, make, model, color_code = map(str.strip, tuple1.split(","))
-
-        # Extract values from the second tuple (x1, y1, x2, y2)
-        x1, y1, x2, y2 = map(str.strip, tuple2.strip("()").split(","))
-
-        # Convert coordinates to integers
-        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-
-        # Validate bounding box coordinates
-        if x2 <= x1 or y2 <= y1:
-            print(
-                "LLM provided invalid crop coordinates! x2 must be greater than x1, and y2 must be greater than y1."
-            )
-            return (
-                year,
-                make,
-                model,
-                color_code,
-            )
-
-        return (
-            year,
-            make,
-            model,
-            color_code,
-            x1,
-            y1,
-            x2,
-            y2,
+        response = await _get_model(instruction).generate_content_async(
+            contents,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": _identification_schema(with_bbox),
+            },
+            stream=on_partial is not None,
         )
+        if on_partial is None:
+            return response.text
+        text = ""
+        async for chunk in response:
+            text += chunk.text
+            on_partial(text)
+        return text
+    except Exception as e:
+        code = getattr(e, "code", None)
+        if code == 429 or (isinstance(code, int) and code >= 500):
+            raise Overloaded(str(e), retry_after=_retry_delay(e)) from e
+        raise
+
+
+async def _identify_vehicles(images, with_bbox=False, on_identified=None):
+    # one Gemini request for the whole batch; returns results in input order (see _parse_identifications).
+    # with on_identified, the response is streamed and on_identified(year, make, model) is called
+    # for the first photo as soon as those fields have arrived
+    instruction = IDENTIFY_WITH_BBOX_INSTRUCTION if with_bbox else IDENTIFY_INSTRUCTION
+    contents = [f"Identify the car in each of these {len(images)} photos."]
+    for index, image_bytes in enumerate(images):
+        mime_type, _ = detect_mime_type(image_bytes)
+        if not mime_type.startswith("image/"):
+            mime_type = "image/jpeg"
+        contents += [f"Photo {index}:", {"mime_type": mime_type, "data": image_bytes}]
 
+    on_partial = None
+    if on_identified is not None:
+        notified = False
+
+        def on_partial(text):
+            nonlocal notified
+            fields = not notified and _streamed_fields(text)
+            if fields:
+                notified = True  # once, even if the request is retried
+                on_identified(*fields)
+
+    try:
+        text = await call_limited_async(_gemini_limiter(), _generate, instruction, contents, with_bbox, on_partial)
     except Exception as e:
-        print(f"Error parsing LLM response: {e}")
+        record_api_error("gemini", type(e.__cause__ if isinstance(e, Overloaded) else e).__name__)
+        return [e] * len(images)
+
+    results = _parse_identifications(text, len(images), with_bbox)
+    for result in results:
+        if isinstance(result, IdentificationError):
+            record_api_error("gemini", "unparseable_response")
+    return results
+
+
+async def _identify_vehicle_streamed(image_bytes, on_identified):
+    (result,) = await _identify_vehicles([image_bytes], on_identified=on_identified)
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+async def _identify_vehicles_batched(images, with_bbox=False):
+    batches = [images[i : i + IDENTIFY_BATCH_SIZE] for i in range(0, len(images), IDENTIFY_BATCH_SIZE)]
+    batch_results = await asyncio.gather(*(_identify_vehicles(batch, with_bbox) for batch in batches))
+    return [result for results in batch_results for result in results]
+
+
+async def _identify_vehicle(image_bytes):
+    (result,) = await _identify_vehicles([image_bytes])
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+async def _identify_vehicle_with_bbox(image_bytes):
+    (result,) = await _identify_vehicles([image_bytes], with_bbox=True)
+    if isinstance(result, Exception):
+        print(f"Error identifying vehicle: {result}")
+        return None
+    return result
+
+
+async def identify_vehicle_async(image_bytes):
+    # returns "(YEAR,MAKE,MODEL,COLOR)" 4-tuple
+    backend = get_backend()
+    if backend is not None:
+        return await asyncio.to_thread(backend.identify_vehicle, image_bytes)
+    return await _on_core_loop(_identify_vehicle(image_bytes))
+
+
+async def identify_vehicle_with_bbox_async(image_bytes):
+    # returns "(YEAR,MAKE,MODEL,COLOR,X1,Y1,X2,Y2)" 8-tuple, a 4-tuple if the box is invalid, or None
+    return await _on_core_loop(_identify_vehicle_with_bbox(image_bytes))
+
+
+async def identify_vehicles_async(images):
+    # returns one entry per image, in order: a "(YEAR,MAKE,MODEL,COLOR)" 4-tuple, or the
+    # exception that image failed with
+    backend = get_backend()
+    if backend is not None:
+        return await asyncio.to_thread(backend.identify_vehicles, list(images))
+    return await _on_core_loop(_identify_vehicles_batched(list(images)))
+
+
+def live_identify_vehicle(image_bytes):
+    # always calls Gemini, regardless of the configured backend
+    return _run_sync(_identify_vehicle(image_bytes))
+
+
+def live_identify_vehicles(images):
+    # always calls Gemini, regardless of the configured backend
+    return _run_sync(_identify_vehicles_batched(list(images)))
+
+
+def identify_vehicle(image_bytes):
+    # returns "(YEAR,MAKE,MODEL,COLOR)" 4-tuple
+    backend = get_backend()
+    if backend is not None:
+        return backend.identify_vehicle(image_bytes)
+    return live_identify_vehicle(image_bytes)
+
+
+def identify_vehicle_streaming(image_bytes, on_identified):
+    # identify_vehicle that calls on_identified(year, make, model) as early as it can: while the
+    # response is still streaming in from Gemini, or straight away for the offline backends.
+    # the callback runs on the core event loop and must not block
+    backend = get_backend()
+    if backend is not None:
+        result = backend.identify_vehicle(image_bytes)
+        if result:
+            on_identified(*result[:3])
+        return result
+    return _run_sync(_identify_vehicle_streamed(image_bytes, on_identified))
+
+
+def identify_vehicles(images):
+    # identifies up to IDENTIFY_BATCH_SIZE photos per request. returns one entry per image, in
+    # order: a "(YEAR,MAKE,MODEL,COLOR)" 4-tuple, or the exception that image failed with
+    backend = get_backend()
+    if backend is not None:
+        return backend.identify_vehicles(list(images))
+    return live_identify_vehicles(images)
+
+
+def identify_vehicle_with_bbox(image_bytes):
+    # returns "(YEAR,MAKE,MODEL,COLOR,X1,Y1,X2,Y2)" 8-tuple, a 4-tuple if the box is invalid, or None
+    return _run_sync(_identify_vehicle_with_bbox(image_bytes))
+
+
+def identify_vehicles_with_bbox(images):
+    # batched identify_vehicle_with_bbox; failed images get their exception instead of a tuple
+    return _run_sync(_identify_vehicles_batched(list(images), with_bbox=True))
+
+
+# One pooled session for every stats request, so repeat lookups reuse keep-alive connections
+# instead of paying a fresh TCP + TLS handshake. Connection errors are retried here; 429 and
+# 5xx answers go through the rate limiter.
+STATS_API_URL = "https://api.api-ninjas.com/v1/cars"
+STATS_API_TIMEOUT = 10
+
+_stats_session = requests.Session()
+_stats_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=max(32, STATS_MAX_CONCURRENCY),
+        max_retries=Retry(total=3, backoff_factor=0.3, allowed_methods=("GET",)),
+    ),
+)
+
+
+def request_car_stats(make: str, model: str, year: str):
+    # returns the list of matches from the stats API (possibly empty), or None if the request failed
+    backend = get_backend()
+    if backend is not None:
+        return backend.request_car_stats(make=make, model=model, year=year)
+    return live_request_car_stats(make=make, model=model, year=year)
+
+
+def _get_stats_response(params, api_key):
+    response = _stats_session.get(
+        STATS_API_URL, params=params, headers={"X-Api-Key": api_key}, timeout=STATS_API_TIMEOUT
+    )
+    if response.status_code == 429 or response.status_code >= 500:
+        raise Overloaded(
+            f"http_{response.status_code}", retry_after=parse_retry_after(response.headers.get("Retry-After"))
+        )
+    return response
+
+
+def live_request_car_stats(make: str, model: str, year: str):
+    # always calls api-ninjas, regardless of the configured backend
+    api_key = os.environ.get("API_NINJAS_KEY", "YOUR_API_KEY")
+    limiter = get_limiter("api_ninjas", api_key, STATS_REQUESTS_PER_MINUTE, STATS_MAX_CONCURRENCY)
+
+    try:
+        response = call_limited(
+            limiter, _get_stats_response, {"year": year, "make": make, "model": model}, api_key
+        )
+    except Overloaded as e:
+        print(f"Stat API request failed after retries: {e}")
+        record_api_error("api_ninjas", str(e))
+        return None
+    except requests.RequestException as e:
+        print(f"Stat API request failed: {e}")
+        record_api_error("api_ninjas", type(e).__name__)
         return None
 
+    if response.status_code == 200:
+        return response.json()
+
+    record_api_error("api_ninjas", f"http_{response.status_code}")
+    print(f"Request failed with status code {response.status_code}: {response.text}")
+    return None
+
+
+def get_car_stats(make: str, model: str, year: str) -> dict:
+    matches = request_car_stats(make=make, model=model, year=year)
+
+    if matches:
+        return matches[0]
+    if matches is not None:
+        print(
+            "Stat API request succeeded, but returned empty. (make, model, and year not recognized)"
+        )
+    return {}
+
+
+async def _get_car_stats(make, model, year):
+    # requests has no async transport, so the pooled session runs on a dedicated executor
+    return await asyncio.get_running_loop().run_in_executor(
+        _stats_executor, get_car_stats, make, model, year
+    )
+
+
+async def get_car_stats_async(make: str, model: str, year: str) -> dict:
+    return await _on_core_loop(_get_car_stats(make, model, year))
 
-# ic(get_car_stats(make="Aston Martin", model="Valhalla", year="2023"))
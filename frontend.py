@@ -1,47 +1,194 @@
 import streamlit as st
 import os
-import uuid
-import json
-from core import identify_vehicle, get_car_stats
-from streamlit_extras.let_it_rain import rain
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collection_store import get_store
+from image_store import image_path_for, migrate_flat_images
+from search_index import get_search_index
+from jobs import DONE, FAILED, PENDING, get_job_queue
+from metrics import start_metrics_server
 
 # Get port from environment variable
 PORT = int(os.getenv("PORT", "8080"))
+# Prometheus scrape endpoint (started once per process)
+start_metrics_server()
 # Page configuration
 st.set_page_config(page_title="TradingCars", page_icon="🚘", layout="wide")
 
-# Directory and file setup
-COLLECTION_DIR = "car_collection"
-METADATA_FILE = os.path.join(COLLECTION_DIR, "metadata.json")
+# cars are stored in car_collection/collection.db (created, along with the directory, on first
+# run). an existing metadata.json is imported on first run
+store = get_store()
 
-if not os.path.exists(COLLECTION_DIR):
-    os.makedirs(COLLECTION_DIR)
 
-if not os.path.exists(METADATA_FILE):
-    with open(METADATA_FILE, "w") as f:
-        json.dump({}, f)
+@st.cache_resource  # once per process: moves images saved in the old flat layout into the image store
+def migrate_images():
+    return migrate_flat_images(store)
 
 
-def load_metadata():
-    with open(METADATA_FILE, "r") as f:
-        return json.load(f)
+migrate_images()
 
+# number of cards rendered per gallery page (users can change it from the gallery controls)
+GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", "12"))
+# how often (seconds) the page checks on uploads that are still being identified
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# threads preparing cards (image decode/encode + HTML) in parallel
+CARD_RENDER_WORKERS = int(os.getenv("CARD_RENDER_WORKERS", str(min(8, (os.cpu_count() or 1) + 2))))
 
-def save_metadata(metadata):
-    with open(METADATA_FILE, "w") as f:
-        json.dump(metadata, f, indent=4)
+@st.cache_resource  # one pool per process, shared by every session and rerun
+def card_render_pool():
+    return ThreadPoolExecutor(max_workers=CARD_RENDER_WORKERS, thread_name_prefix="card-render")
 
 
-# Load logo data once at the start (outside the function)
-@st.cache_data  # Cache the data to avoid reloading on every rerun
-def load_logo_data():
-    with open("logo_icons.json", "r") as f:
-        logo_data = json.load(f)
-    return {item["name"]: item["logo"] for item in logo_data}
+def reset_gallery_page():
+    st.session_state["gallery_page"] = 1
+
+
+def filter_select(label, field, index, within=None):
+    options = dict(index.options(field, within=within))
+    key = f"filter_{field}"
+    # drop selections that no longer exist (e.g. a model of a make that was deselected)
+    if key in st.session_state:
+        st.session_state[key] = [value for value in st.session_state[key] if value in options]
+    return st.multiselect(
+        label,
+        options=list(options),
+        format_func=lambda value: options[value],
+        key=key,
+        on_change=reset_gallery_page,
+    )
+
+
+def gallery_filters(index):
+    # search and filter widgets; returns the SearchIndex.search arguments they select
+    with st.expander("Search & filter", icon="🔍"):
+        text = st.text_input(
+            "Search",
+            placeholder="e.g. porsche 911",
+            key="search_text",
+            on_change=reset_gallery_page,
+        )
+
+        filters = {}
+        col_make, col_model = st.columns(2)
+        with col_make:
+            filters["make"] = filter_select("Make", "make", index)
+        with col_model:
+            filters["model"] = filter_select("Model", "model", index, within={"make": filters["make"]})
+
+        col_drive, col_class, col_fuel, col_color = st.columns(4)
+        with col_drive:
+            filters["drive"] = filter_select("Drivetrain", "drive", index)
+        with col_class:
+            filters["class"] = filter_select("Class", "class", index)
+        with col_fuel:
+            filters["fuel_type"] = filter_select("Fuel", "fuel_type", index)
+        with col_color:
+            filters["color"] = filter_select("Color", "color", index)
+
+        year_min = year_max = None
+        years = index.year_range()
+        if years and years[0] < years[1]:
+            # the slider's value lives in session state only (a default as well makes Streamlit warn)
+            selected = st.session_state.get("filter_year")
+            if selected is None:
+                st.session_state["filter_year"] = years
+            elif selected[0] < years[0] or selected[1] > years[1]:
+                # keep the selection inside the range of the current collection
+                low, high = max(selected[0], years[0]), min(selected[1], years[1])
+                st.session_state["filter_year"] = (low, high) if low <= high else years
+            year_min, year_max = st.slider(
+                "Year", years[0], years[1], key="filter_year", on_change=reset_gallery_page
+            )
+            if (year_min, year_max) == years:
+                year_min = year_max = None  # the full range filters nothing
+
+    return {
+        "filters": {field: values for field, values in filters.items() if values},
+        "year_min": year_min,
+        "year_max": year_max,
+        "text": text.strip(),
+    }
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def watch_jobs(job_ids):
+    # reruns on its own while uploads are in flight, and refreshes the page as soon as one is done
+    jobs = get_job_queue().get_jobs(job_ids)
+    if any(jobs.get(job_id, {}).get("status", DONE) in (DONE, FAILED) for job_id in job_ids):
+        st.rerun()
+
+
+def show_job_results(job_queue):
+    # reports this session's uploads that finished since the last run
+    my_jobs = st.session_state.get("my_jobs", [])
+    if not my_jobs:
+        return
+    jobs = job_queue.get_jobs(my_jobs)
+    for job_id in list(my_jobs):
+        job = jobs.get(job_id)
+        if job is None or job["status"] == FAILED:
+            st.error(f"Error during identification: {job['error'] if job else 'the upload was lost'}")
+        elif job["status"] == DONE:
+            car_info = job["car_info"] or {}
+            st.success(
+                f"{car_info.get('year', 'YearUnknown')} {car_info.get('make', 'MakeUnknown')} {car_info.get('model', 'ModelUnknown')} successfully added to your collection!"
+            )
+            st.balloons()
+        else:
+            continue
+        my_jobs.remove(job_id)
+
+
+def render_gallery_page(page_cars, pending_jobs=()):
+    from card import find_suitable_card_body, pending_card_body
+    from gallery import gallery_height, render_gallery
+
+    # Check if the image files exist (in a shared collection this may download them, so the
+    # lookups run on the pool too)
+    pool = card_render_pool()
+    image_paths = pool.map(lambda car: image_path_for(*car), page_cars)
+    visible_cars = [
+        (entry_key, image_path, details)
+        for (entry_key, details), image_path in zip(page_cars, image_paths)
+        if os.path.exists(image_path)
+    ]
+
+    # prepare the cards concurrently, showing progress while they come in, then mount the
+    # whole page as a single component
+    placeholder = st.empty()
+    futures = {
+        pool.submit(
+            find_suitable_card_body, vehicle_image_path=image_path, vehicle_details=details
+        ): idx
+        for idx, (_, image_path, details) in enumerate(visible_cars)
+    }
+
+    card_bodies = [None] * len(visible_cars)
+    errors = []
+    for done, future in enumerate(as_completed(futures), start=1):
+        idx = futures[future]
+        try:
+            card_bodies[idx] = future.result()
+        except Exception as e:
+            errors.append(f"Error displaying card {visible_cars[idx][0]}: {str(e)}")
+        if done < len(futures):
+            placeholder.progress(done / len(futures), text=f"Preparing cards ({done}/{len(futures)})")
+
+    # uploads still being identified go first, as placeholders
+    card_bodies = [
+        pending_card_body("Queued" if status == PENDING else "In progress") for _, status in pending_jobs
+    ] + [card_body for card_body in card_bodies if card_body]
+    drivetrains = [details.get("drive") for _, _, details in visible_cars]
+    makes = [details.get("make") for _, _, details in visible_cars]
+    with placeholder.container():
+        st.components.v1.html(
+            render_gallery(card_bodies, drivetrains=drivetrains, makes=makes),
+            height=gallery_height(len(card_bodies)),
+        )
+    for error in errors:
+        st.error(error)
 
 
 def main_page():
-    from card import find_suitable_card
 
     # Inject CSS to import the Roboto font and force it on all app elements
     st.markdown(
@@ -63,81 +210,90 @@ def main_page():
         type=["jpg", "jpeg"],
         help="Upload a JPG car photo to be recognized by AI and placed in your collection. Non-car photos will cause errors.",
     )
-    if uploaded_file:
-        image_bytes = uploaded_file.getvalue()
-        with st.spinner("Identifying the car...", show_time=True):
-            try:
-                result = identify_vehicle(image_bytes)
-
-                # Ensure result is in the correct format
-                if isinstance(result, (list, tuple)):
-                    car_info = {
-                        "year": str(result[0]) if len(result) > 0 else "Unknown",
-                        "make": str(result[1]) if len(result) > 1 else "Unknown",
-                        "model": str(result[2]) if len(result) > 2 else "Unknown",
-                        "color": str(result[3]) if len(result) > 3 else "Unknown",
-                        # "x1": result[4] if len(result) > 4 else "Unknown", # bounding boxes not yet implemented
-                        # "y1": result[5] if len(result) > 5 else "Unknown", # bounding boxes not yet implemented
-                        # "x2": result[6] if len(result) > 6 else "Unknown", # bounding boxes not yet implemented
-                        # "y2": result[7] if len(result) > 7 else "Unknown", # bounding boxes not yet implemented
-                    }
-                    api_stats = get_car_stats(  # uses year, make, and model to fetch api_stats from Ninja Api
-                        make=car_info.get("make", "Unknown"),
-                        model=car_info.get("model", "Unknown"),
-                        year=car_info.get("year", "Unknown"),
-                    )
-                    # remove year, make, and model from api_stats before merging with car_info
-                    for key in ["year", "make", "model"]:
-                        api_stats.pop(key, None)
-                    car_info.update(api_stats)  # merge car_info and car_stats
-                else:
-                    car_info = result
-                # Save image
-                image_filename = f"{uuid.uuid4().hex}.png"
-                image_path = os.path.join(COLLECTION_DIR, image_filename)
-                with open(image_path, "wb") as f:
-                    f.write(image_bytes)
-
-                # Update metadata
-                metadata = load_metadata()
-                metadata[image_filename] = car_info  # save car_info to disk
-                save_metadata(metadata)
-
-                st.success(
-                    f"{car_info.get('year', 'YearUnknown')} {car_info.get('make', 'MakeUnknown')} {car_info.get('model', 'ModelUnknown')} successfully added to your collection!"
-                )
-                st.balloons()
-
-            except Exception as e:
-                st.error(f"Error during identification: {str(e)}")
-
-    metadata = load_metadata()
-
-    if metadata:
+    job_queue = get_job_queue()
+    # the uploader keeps its file across reruns, so each upload is queued once
+    if uploaded_file and st.session_state.get("queued_upload") != uploaded_file.file_id:
+        job_id = job_queue.enqueue(uploaded_file.getvalue())
+        st.session_state["queued_upload"] = uploaded_file.file_id
+        st.session_state.setdefault("my_jobs", []).append(job_id)
+        st.session_state["gallery_page"] = 1  # jump back to the newest cars
+        st.toast("Identifying your car... it will show up in your collection shortly.", icon="🚘")
+
+    show_job_results(job_queue)
+
+    store.sync_if_stale()  # picks up cars other replicas added, when the collection is shared
+    total_cars = store.count_cars()
+    pending_jobs = job_queue.unfinished_jobs()
+    if pending_jobs:
+        watch_jobs([job_id for job_id, _ in pending_jobs])
+
+    if total_cars or pending_jobs:
         st.markdown("### My Collection")
-        cols = st.columns(3)
-
-        for idx, (image_filename, details) in enumerate(
-            reversed(list(metadata.items()))  # newest cars appear first in gallery
-        ):
-
-            image_path = os.path.join(COLLECTION_DIR, image_filename)
-
-            # Check if the image file exists
-            if not os.path.exists(image_path):
-                continue
-
-            try:
-                col = cols[idx % 3]
-                with col:
-                    card_html = find_suitable_card(
-                        vehicle_image_path=image_path, vehicle_details=details
-                    )
-                    st.components.v1.html(card_html, height=350)
 
-            except Exception as e:
-                st.error(f"Error displaying card {image_filename}: {str(e)}")
-                continue
+        # the index is built once per process (in the background) and afterwards only reads
+        # newly added cars. until it's ready the gallery is shown unfiltered
+        index = get_search_index(wait=False)
+        if index is not None:
+            search = gallery_filters(index)
+            filtering = bool(search["filters"] or search["year_min"] is not None or search["text"])
+        else:
+            st.caption("Search will be available in a moment...")
+            filtering = False
+
+        page_size = st.session_state.get("gallery_page_size", GALLERY_PAGE_SIZE)
+        page = st.session_state.get("gallery_page", 1)
+
+        if filtering:
+            # the index picks the page's cars; only those are fetched from the store
+            shown_cars, page_ids = index.search(**search, limit=page_size, offset=(page - 1) * page_size)
+            page_count = max(1, -(-shown_cars // page_size))  # ceiling division
+            if page > page_count:
+                page = page_count
+                _, page_ids = index.search(**search, limit=page_size, offset=(page - 1) * page_size)
+            page_cars = store.cars_by_ids(page_ids)
+        else:
+            shown_cars = total_cars
+            page_count = max(1, -(-total_cars // page_size))  # ceiling division
+            page = min(page, page_count)
+
+            # only the visible page is fetched from the store, newest cars first
+            page_cars = store.query_cars(
+                newest_first=True, limit=page_size, offset=(page - 1) * page_size
+            )
+
+        shown_pending = pending_jobs if page == 1 and not filtering else []
+        if page_cars or shown_pending:
+            render_gallery_page(page_cars, pending_jobs=shown_pending)
+        else:
+            st.info("No cars in your collection match these filters.")
+
+        nav_prev, nav_page, nav_next, nav_size = st.columns([1, 2, 1, 2])
+        with nav_prev:
+            if st.button("← Newer", disabled=page <= 1, use_container_width=True):
+                st.session_state["gallery_page"] = page - 1
+                st.rerun()
+        with nav_page:
+            st.markdown(
+                f"<div style='text-align: center'>Page {page} of {page_count} ({shown_cars} cars)</div>",
+                unsafe_allow_html=True,
+            )
+        with nav_next:
+            if st.button("Older →", disabled=page >= page_count, use_container_width=True):
+                st.session_state["gallery_page"] = page + 1
+                st.rerun()
+        with nav_size:
+            page_size_options = sorted({GALLERY_PAGE_SIZE, 6, 12, 24, 48})
+            new_page_size = st.selectbox(
+                "Cars per page",
+                options=page_size_options,
+                index=page_size_options.index(page_size),
+                label_visibility="collapsed",
+                format_func=lambda n: f"{n} cars per page",
+            )
+            if new_page_size != page_size:
+                st.session_state["gallery_page_size"] = new_page_size
+                st.session_state["gallery_page"] = 1
+                st.rerun()
 
     else:
         st.info("No cars in your collection yet. Add some cars to get started!")
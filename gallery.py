@@ -0,0 +1,43 @@
+from card import CARD_FONT_LINK, CARD_STYLESHEET, drivetrain_icon_css, logo_css
+
+# Renders a page of the collection as a single HTML document, mounted as one Streamlit
+# component. The font, the card stylesheet, the drivetrain icons and the make logos are
+# defined once at the top and every card references them, so the page weight grows with the
+# card content only rather than with N copies of the CSS, fonts and icons in N iframes.
+
+GALLERY_COLUMNS = 3
+CARD_ROW_HEIGHT = 350  # px, matches the height each card used to get as its own component
+
+GALLERY_STYLESHEET = """
+<style>
+    body {
+        margin: 0;
+    }
+    .gallery {
+        display: grid;
+        grid-template-columns: repeat(%d, 1fr);
+        grid-auto-rows: %dpx;
+        justify-items: start;
+    }
+</style>
+""" % (GALLERY_COLUMNS, CARD_ROW_HEIGHT)
+
+
+def gallery_height(card_count: int) -> int:
+    rows = -(-card_count // GALLERY_COLUMNS)  # ceiling division
+    return rows * CARD_ROW_HEIGHT
+
+
+def render_gallery(card_bodies, drivetrains=(), makes=()):
+    # card_bodies: markup from card.find_suitable_card_body, newest first
+    # drivetrains, makes: the drivetrains and makes shown on those cards (their icons and logos
+    # are embedded once)
+    cells = "".join(f"<div class='gallery-cell'>{card_body}</div>" for card_body in card_bodies)
+    return (
+        CARD_FONT_LINK
+        + CARD_STYLESHEET
+        + drivetrain_icon_css(drivetrains)
+        + logo_css(makes)
+        + GALLERY_STYLESHEET
+        + f"<div class='gallery'>{cells}</div>"
+    )
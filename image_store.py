@@ -0,0 +1,211 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from collection_store import get_store
+from config import COLLECTION_DIR
+from storage import LocalStorage, get_storage
+from thumbnails import invalidate_thumbnails
+
+# Content-addressed storage for collection images. An image is stored once under the SHA-256
+# of its bytes, sharded into two levels of prefix directories so no directory grows huge:
+#
+#     car_collection/images/3f/a2/3fa2...e9.jpg
+#
+# Identical uploads share one blob; the collection database keeps a reference count per blob
+# and the file is deleted when its last car is removed. Each car records its blob path under
+# car_info["image"] and the detected type under car_info["mime_type"].
+#
+# With shared storage (STORAGE_URL, see storage.py) the blobs live there, and the images
+# directory becomes a read-through cache of the ones this replica has used, kept under
+# IMAGE_CACHE_MB by evicting the least recently used. Blobs never change, so cached copies
+# never go stale.
+
+IMAGE_DIR_NAME = "images"
+_FLAT_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_MB", "1024")) * 1024 * 1024
+# cached copies get a fixed mtime, so thumbnail and card cache keys (which include the mtime)
+# survive an eviction and re-download. recency is tracked in the access time instead
+CACHED_BLOB_MTIME = 0
+
+_local_images = LocalStorage(COLLECTION_DIR)
+_cache_lock = threading.Lock()
+_cache_bytes = None  # running total of cached image bytes, computed lazily
+
+_MIME_TYPES = (
+    # (magic prefix, offset, mime type, extension)
+    (b"\xff\xd8\xff", 0, "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png", ".png"),
+    (b"WEBP", 8, "image/webp", ".webp"),
+    (b"ftypheic", 4, "image/heic", ".heic"),
+    (b"ftypmif1", 4, "image/heic", ".heic"),
+    (b"GIF8", 0, "image/gif", ".gif"),
+)
+
+
+def detect_mime_type(image_bytes):
+    # returns (mime type, file extension) from the file's magic bytes
+    for magic, offset, mime_type, extension in _MIME_TYPES:
+        if image_bytes[offset : offset + len(magic)] == magic:
+            return mime_type, extension
+    return "application/octet-stream", ".bin"
+
+
+def blob_path_for(image_bytes):
+    # returns (path relative to the collection directory, mime type)
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    mime_type, extension = detect_mime_type(image_bytes)
+    return os.path.join(IMAGE_DIR_NAME, digest[:2], digest[2:4], f"{digest}{extension}"), mime_type
+
+
+def _blob_key(blob_path):
+    return blob_path.replace(os.sep, "/")
+
+
+def _cache_directory_entries():
+    for root, _, filenames in os.walk(os.path.join(COLLECTION_DIR, IMAGE_DIR_NAME)):
+        for filename in filenames:
+            if not filename.endswith(".tmp"):
+                yield os.path.join(root, filename)
+
+
+def _add_to_cache(full_path, size):
+    # called with a freshly written copy; evicts least recently used copies when over budget
+    global _cache_bytes
+    now = time.time()
+    os.utime(full_path, (now, CACHED_BLOB_MTIME))
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(os.path.getsize(path) for path in _cache_directory_entries())
+        else:
+            _cache_bytes += size
+        if _cache_bytes <= IMAGE_CACHE_BYTES:
+            return
+
+        # evict down to 90% of the budget, so eviction scans don't happen on every download
+        entries = []
+        for path in _cache_directory_entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+        entries.sort()
+        for _, entry_size, path in entries:
+            if _cache_bytes <= IMAGE_CACHE_BYTES * 0.9:
+                break
+            if path == full_path:
+                continue
+            try:
+                os.remove(path)
+                _cache_bytes -= entry_size
+            except FileNotFoundError:
+                pass
+
+
+def put_image(image_bytes):
+    # stores the image (once per distinct content) and takes a reference on it.
+    # returns (blob path relative to the collection directory, mime type)
+    blob_path, mime_type = blob_path_for(image_bytes)
+    key = _blob_key(blob_path)
+    # take the reference first, so a concurrent release of the same blob can't delete it
+    # between our existence check and the write
+    refcount = get_store().add_blob_reference(blob_path, mime_type)
+
+    storage = get_storage()
+    if storage.shared:
+        storage.put(key, image_bytes)
+        _local_images.put(key, image_bytes)  # keep a local copy for the thumbnail
+        _add_to_cache(os.path.join(COLLECTION_DIR, blob_path), len(image_bytes))
+    elif refcount == 1 or not _local_images.exists(key):
+        _local_images.put(key, image_bytes)
+    return blob_path, mime_type
+
+
+def release_image(blob_path):
+    # drops a reference; the blob and its thumbnails are deleted with the last one. in a
+    # shared collection only the local copy goes, since other replicas keep their own counts
+    if get_store().release_blob_reference(blob_path) > 0:
+        return
+    full_path = os.path.join(COLLECTION_DIR, blob_path)
+    invalidate_thumbnails(full_path)
+    _local_images.delete(_blob_key(blob_path))
+
+
+def _fetch_blob(blob_path):
+    # read-through: makes sure a shared blob has a local copy and marks it recently used
+    full_path = os.path.join(COLLECTION_DIR, blob_path)
+    try:
+        os.utime(full_path, (time.time(), CACHED_BLOB_MTIME))
+        return
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    tmp_path = f"{full_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        get_storage().download(_blob_key(blob_path), tmp_path)
+    except Exception as e:
+        print(f"Could not fetch image {blob_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    os.replace(tmp_path, full_path)
+    _add_to_cache(full_path, os.path.getsize(full_path))
+
+
+def image_path_for(entry_key, car_info):
+    # where a car's image lives on disk: its blob, or the flat file of a not-yet-migrated entry.
+    # in a shared collection the blob is downloaded first if this replica has no copy
+    blob_path = car_info.get("image") if isinstance(car_info, dict) else None
+    if blob_path:
+        if get_storage().shared:
+            _fetch_blob(blob_path)
+        return os.path.join(COLLECTION_DIR, blob_path)
+    return os.path.join(COLLECTION_DIR, entry_key)
+
+
+def migrate_flat_images(store=None):
+    # moves images from the flat `<uuid>.png` layout into the blob store, and re-keys their
+    # entries to the bare uuid (the old keys claimed PNG for what were JPEG bytes).
+    # returns the number of entries migrated
+    # flat images sat directly in the collection directory; once none are left there is no
+    # need to scan the whole table on every start
+    with os.scandir(COLLECTION_DIR) as entries:
+        if not any(entry.is_file() and entry.name.lower().endswith(_FLAT_IMAGE_EXTENSIONS) for entry in entries):
+            return 0
+
+    store = store or get_store()
+    migrated = 0
+    for entry_key, car_info in store.cars_without_image_blob():
+        legacy_path = os.path.join(COLLECTION_DIR, entry_key)
+        try:
+            with open(legacy_path, "rb") as f:
+                image_bytes = f.read()
+        except FileNotFoundError:
+            print(f"Image for {entry_key} is missing, leaving the entry as is")
+            continue
+
+        blob_path, mime_type = put_image(image_bytes)
+        car_info["image"] = blob_path
+        car_info["mime_type"] = mime_type
+        new_key = os.path.splitext(entry_key)[0]
+        if new_key != entry_key and store.get_car(new_key) is not None:
+            new_key = entry_key  # keep the old key rather than clobber another entry
+        store.rename_car(entry_key, new_key, car_info)
+
+        invalidate_thumbnails(legacy_path)
+        os.remove(legacy_path)
+        migrated += 1
+
+    if migrated:
+        print(f"Moved {migrated} images into the content-addressed image store")
+    return migrated
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("usage: python image_store.py migrate")
+        sys.exit(1)
+    migrate_flat_images()
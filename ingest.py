@@ -0,0 +1,195 @@
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import COLLECTION_DIR
+from core import IDENTIFY_BATCH_SIZE
+from pipeline import add_car_stats, identify_cars, save_car
+
+# Bulk import of a directory of car photos into the collection:
+#
+#     python ingest.py ~/Pictures/spotting --workers 8
+#
+# Photos are identified in batches (--batch-size per Gemini request) to cut per-request overhead.
+# Every finished image is recorded (by content hash) in a journal, so an interrupted run can
+# simply be started again: finished images are skipped without calling any API.
+
+DEFAULT_JOURNAL = os.path.join(COLLECTION_DIR, "ingest_journal.jsonl")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+STAGES = ("identify", "stats", "save")
+
+
+def find_images(directory):
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, filename)
+
+
+def load_journal(journal_path):
+    # returns the content hashes of every image a previous run finished
+    done = set()
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a torn final line from an interrupted run
+            if entry.get("status") == "done":
+                done.add(entry["sha256"])
+    return done
+
+
+class Journal:
+    def __init__(self, journal_path):
+        directory = os.path.dirname(journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(journal_path, "a")
+        self._lock = threading.Lock()
+
+    def record(self, **entry):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def ingest_batch(image_paths, done, journal):
+    # runs a batch of images through the pipeline, identifying them with one model request.
+    # returns [(image_path, status, {stage: seconds})]
+    outcomes = []
+    pending = []  # (image_path, sha256, image_bytes)
+    for image_path in image_paths:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        sha256 = hashlib.sha256(image_bytes).hexdigest()
+        if sha256 in done or any(sha256 == other for _, other, _ in pending):
+            outcomes.append((image_path, "skipped", {}))
+        else:
+            pending.append((image_path, sha256, image_bytes))
+    if not pending:
+        return outcomes
+
+    start = time.perf_counter()
+    try:
+        car_infos = identify_cars([image_bytes for _, _, image_bytes in pending])
+    except Exception as e:
+        car_infos = [e] * len(pending)
+    # the request is shared, so each image is charged its share of it
+    identify_seconds = (time.perf_counter() - start) / len(pending)
+
+    for (image_path, sha256, image_bytes), car_info in zip(pending, car_infos):
+        timings = {"identify": identify_seconds}
+        try:
+            if isinstance(car_info, Exception):
+                raise car_info
+
+            start = time.perf_counter()
+            if isinstance(car_info, dict):
+                add_car_stats(car_info)
+            timings["stats"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            entry_key = save_car(image_bytes, car_info)
+            timings["save"] = time.perf_counter() - start
+        except Exception as e:
+            print(f"Error ingesting {image_path}: {e}")
+            journal.record(path=image_path, sha256=sha256, status="failed", error=str(e))
+            outcomes.append((image_path, "failed", timings))
+            continue
+
+        done.add(sha256)  # also skips duplicate photos later in the same run
+        journal.record(path=image_path, sha256=sha256, status="done", image_filename=entry_key)
+        outcomes.append((image_path, "done", timings))
+    return outcomes
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def print_report(counts, stage_timings, elapsed):
+    processed = counts["done"] + counts["failed"]
+    print(
+        f"\nIngested {counts['done']} images, skipped {counts['skipped']}, "
+        f"failed {counts['failed']} in {elapsed:.1f}s "
+        f"({processed / elapsed if elapsed else 0:.2f} images/s)"
+    )
+    for stage in STAGES:
+        values = stage_timings[stage]
+        if not values:
+            continue
+        print(
+            f"  {stage:<9} mean {statistics.mean(values) * 1000:8.1f} ms   "
+            f"p50 {_percentile(values, 0.50) * 1000:8.1f} ms   "
+            f"p95 {_percentile(values, 0.95) * 1000:8.1f} ms"
+        )
+
+
+def ingest_directory(
+    directory, workers: int = 4, journal_path=DEFAULT_JOURNAL, batch_size: int = IDENTIFY_BATCH_SIZE
+):
+    done = load_journal(journal_path)
+    journal = Journal(journal_path)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    stage_timings = {stage: [] for stage in STAGES}
+
+    image_paths = list(find_images(directory))
+    batches = [image_paths[i : i + batch_size] for i in range(0, len(image_paths), batch_size)]
+
+    start = time.perf_counter()
+    finished = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(ingest_batch, batch, done, journal) for batch in batches]
+            for future in as_completed(futures):
+                for image_path, status, timings in future.result():
+                    finished += 1
+                    counts[status] += 1
+                    for stage, seconds in timings.items():
+                        stage_timings[stage].append(seconds)
+                    if status != "skipped":
+                        print(f"[{finished}/{len(image_paths)}] {status}: {image_path}")
+    finally:
+        journal.close()
+        print_report(counts, stage_timings, time.perf_counter() - start)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a directory of car photos into the collection.")
+    parser.add_argument("directory", help="directory to scan (recursively) for JPEG photos")
+    parser.add_argument("--workers", type=int, default=4, help="number of batches processed concurrently")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=IDENTIFY_BATCH_SIZE,
+        help="images identified per model request",
+    )
+    parser.add_argument(
+        "--journal",
+        default=DEFAULT_JOURNAL,
+        help="journal of finished images, used to resume interrupted runs",
+    )
+    args = parser.parse_args()
+    ingest_directory(
+        args.directory,
+        workers=args.workers,
+        journal_path=args.journal,
+        batch_size=args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import COLLECTION_DIR
+from metrics import UPLOADS, time_stage
+
+# Background processing of uploads. The Streamlit script only queues the photo and returns;
+# a small pool of worker threads in the process runs the identify -> stats -> save pipeline,
+# so a slow Gemini or api-ninjas call no longer holds a script thread for the whole round trip.
+#
+# Jobs are rows in car_collection/jobs.db, photo included, so queued uploads survive a restart.
+# Jobs that were running when the process stopped are put back in the queue on startup.
+
+JOBS_DB_FILE = os.path.join(COLLECTION_DIR, "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# finished jobs are kept this long (seconds) so sessions can pick up their results
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    image BLOB,
+    car_info TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+def _process(image_bytes):
+    from pipeline import process_image
+
+    return process_image(image_bytes)
+
+
+class JobQueue:
+    def __init__(self, db_path=JOBS_DB_FILE, handler=_process):
+        # handler(image_bytes) -> car_info runs each job on a worker thread
+        self.db_path = db_path
+        self.handler = handler
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._workers = []
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        # one connection per thread, as in collection_store.py
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, image_bytes) -> int:
+        # returns the job id
+        now = time.time()
+        with self._connection() as conn:
+            job_id = conn.execute(
+                "INSERT INTO jobs (status, image, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (PENDING, image_bytes, now, now),
+            ).lastrowid
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get_jobs(self, job_ids):
+        # returns {job id: {"status", "car_info", "error"}} for the jobs that still exist
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        placeholders = ",".join("?" * len(job_ids))
+        rows = (
+            self._connection()
+            .execute(
+                f"SELECT id, status, car_info, error FROM jobs WHERE id IN ({placeholders})", job_ids
+            )
+            .fetchall()
+        )
+        return {
+            job_id: {
+                "status": status,
+                "car_info": json.loads(car_info) if car_info else None,
+                "error": error,
+            }
+            for job_id, status, car_info, error in rows
+        }
+
+    def unfinished_jobs(self):
+        # returns [(job id, status)] of queued and running jobs, newest first
+        return (
+            self._connection()
+            .execute(
+                "SELECT id, status FROM jobs WHERE status IN (?, ?) ORDER BY id DESC",
+                (PENDING, RUNNING),
+            )
+            .fetchall()
+        )
+
+    def recover(self) -> int:
+        # requeues jobs interrupted by a restart and drops old finished ones.
+        # returns the number of jobs requeued
+        with self._connection() as conn:
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (PENDING, time.time(), RUNNING),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - JOB_RETENTION_SECONDS),
+            )
+        if requeued:
+            print(f"Requeued {requeued} interrupted upload jobs")
+        return requeued
+
+    def _claim(self):
+        # atomically takes the oldest pending job; returns (job id, image bytes) or None
+        with self._connection() as conn:
+            return conn.execute(
+                """
+                UPDATE jobs SET status = ?, updated_at = ?
+                WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY id LIMIT 1)
+                RETURNING id, image
+                """,
+                (RUNNING, time.time(), PENDING),
+            ).fetchone()
+
+    def _finish(self, job_id, status, car_info=None, error=None):
+        # the photo is in the image store (or the job failed), so the copy in the queue goes
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, car_info = ?, error = ?, image = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (status, json.dumps(car_info) if car_info is not None else None, error, time.time(), job_id),
+            )
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1)
+                continue
+
+            job_id, image_bytes = job
+            try:
+                with time_stage("upload"):
+                    car_info = self.handler(image_bytes)
+            except Exception as e:
+                print(f"Upload job {job_id} failed: {e}")
+                UPLOADS.labels(outcome="failed").inc()
+                self._finish(job_id, FAILED, error=str(e))
+            else:
+                UPLOADS.labels(outcome="added").inc()
+                self._finish(job_id, DONE, car_info=car_info)
+
+    def start(self, workers=JOB_WORKERS):
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f"upload-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    # process-wide queue; the first call requeues interrupted jobs and starts the workers
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue()
+            _default_queue.recover()
+            _default_queue.start()
+        return _default_queue
@@ -0,0 +1,85 @@
+import json
+import os
+import re
+import threading
+import unicodedata
+
+# Make -> logo lookup for the cards. Logos come from the local asset pack built by
+# build_logos.py (logo_assets.json: size-normalized PNGs as data URIs), so rendering a card
+# makes no third-party requests. Makes missing from the pack fall back to the remote URL in
+# logo_icons.json. The pack is the complete precompiled lookup (aliases and fallbacks
+# included), so the app loads one file and does no work on it. Make names are normalized
+# and run through an alias table, so "Mercedes Benz", "VW" or "Citroen" find their logo too.
+
+LOGO_ICONS_FILE = "logo_icons.json"
+LOGO_ASSETS_FILE = "logo_assets.json"
+
+# common alternative spellings -> the name used in logo_icons.json
+MAKE_ALIASES = {
+    "vw": "Volkswagen",
+    "volkswagenag": "Volkswagen",
+    "chevy": "Chevrolet",
+    "mercedesamg": "Mercedes-Benz",
+    "mercedesmaybach": "Maybach",
+    "benz": "Mercedes-Benz",
+    "alfa": "Alfa Romeo",
+    "rangerover": "Land Rover",
+    "minicooper": "Mini",
+    "bmwmini": "Mini",
+    "astonmartinlagonda": "Aston Martin",
+    "ruf": "Ruf logo",
+    "hennessey": "Hennessey logo",
+    "mustang": "Mustang logo",
+    "morgan": "Morgan Motor",
+    "vector": "Vector Motors",
+    "gm": "General Motors",
+    "maruti": "Maruti Suzuki",
+    "greatwallmotors": "Great Wall",
+}
+
+
+def normalize_make(make) -> str:
+    # "Citroën" -> "citroen", "Mercedes-Benz" -> "mercedesbenz", "Rolls-Royce" -> "rollsroyce"
+    ascii_make = unicodedata.normalize("NFKD", str(make)).encode("ascii", "ignore").decode()
+    return re.sub(r"[^0-9a-z]", "", ascii_make.lower())
+
+
+_logos = None
+_logos_lock = threading.Lock()
+
+
+def compile_logos(logo_data, local_logos=None):
+    # returns {normalized make or alias: logo src}, preferring local data URIs over remote URLs.
+    # logo_data: the entries of logo_icons.json; local_logos: {normalized make: data URI}
+    logos = {normalize_make(item["name"]): item["logo"] for item in logo_data}
+    logos.update(local_logos or {})
+
+    for alias, name in MAKE_ALIASES.items():
+        target = logos.get(normalize_make(name))
+        if target:
+            logos.setdefault(alias, target)
+    return logos
+
+
+def _load_logos():
+    # logo_assets.json is the complete, precompiled lookup; without it, the remote URLs
+    if os.path.exists(LOGO_ASSETS_FILE):
+        with open(LOGO_ASSETS_FILE, "r") as f:
+            return json.load(f)
+    with open(LOGO_ICONS_FILE, "r") as f:
+        return compile_logos(json.load(f))
+
+
+def get_logos() -> dict:
+    global _logos
+    with _logos_lock:
+        if _logos is None:
+            _logos = _load_logos()
+        return _logos
+
+
+def logo_for_make(make):
+    # returns an <img> src for the make's logo, or None
+    if not make:
+        return None
+    return get_logos().get(normalize_make(make))
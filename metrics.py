@@ -0,0 +1,76 @@
+import os
+import threading
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Prometheus metrics for the upload and gallery paths. The app serves them on METRICS_PORT
+# (default 9090), next to the Streamlit port, e.g.
+#
+#     histogram_quantile(0.95, sum by (le, stage) (rate(trading_cars_stage_seconds_bucket[5m])))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+
+STAGE_SECONDS = Histogram(
+    "trading_cars_stage_seconds",
+    "Time spent in each stage of the upload and gallery paths",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+CACHE_REQUESTS = Counter(
+    "trading_cars_cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+
+EXTERNAL_API_ERRORS = Counter(
+    "trading_cars_external_api_errors_total",
+    "Failed calls to external APIs",
+    ["api", "reason"],
+)
+
+API_BACKOFFS = Counter(
+    "trading_cars_external_api_backoffs_total",
+    "External API requests answered with 429 or 5xx, which the rate limiter backs off from",
+    ["api"],
+)
+
+API_CONCURRENCY_LIMIT = Gauge(
+    "trading_cars_external_api_concurrency_limit",
+    "Requests the rate limiter currently lets run at once, per API",
+    ["api"],
+)
+
+UPLOADS = Counter(
+    "trading_cars_uploads_total",
+    "Photos processed by the upload pipeline",
+    ["outcome"],
+)
+
+_server_started = False
+_server_lock = threading.Lock()
+
+
+def time_stage(stage: str):
+    # context manager recording how long the block took, e.g. `with time_stage("identify"):`
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+
+def record_cache(cache: str, result: str):
+    CACHE_REQUESTS.labels(cache=cache, result=result).inc()
+
+
+def record_api_error(api: str, reason: str):
+    EXTERNAL_API_ERRORS.labels(api=api, reason=reason).inc()
+
+
+def start_metrics_server(port: int = METRICS_PORT):
+    # safe to call on every Streamlit rerun: the scrape endpoint is started once per process
+    global _server_started
+    with _server_lock:
+        if _server_started:
+            return
+        try:
+            start_http_server(port)
+        except OSError as e:
+            print(f"Could not start metrics endpoint on port {port}: {e}")
+        _server_started = True
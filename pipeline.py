@@ -0,0 +1,202 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collection_store import get_store
+from preprocess import prepare_for_model
+from core import identify_vehicle_streaming
+from recognition_cache import dhash, get_recognition_cache, identify_vehicle_cached, identify_vehicles_cached
+from stats_cache import lookup_car_stats
+from thumbnails import get_thumbnail
+from image_store import image_path_for, put_image, release_image
+from metrics import time_stage
+
+# The identify -> stats -> save steps that turn a photo into a collection entry. Shared by the
+# Streamlit upload flow (frontend.py) and bulk imports (ingest.py).
+#
+# A single upload (process_image) is pipelined rather than run step by step: the photo is
+# stored and its thumbnail generated while the model is still looking at it, the stats lookup
+# starts as soon as the streamed answer names the car, and the new card is rendered into the
+# card cache while the entry is saved, so the gallery refresh that follows finds it ready.
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "8"))
+
+_pipeline_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="upload-pipeline")
+
+
+def _car_info_from(result, image_sizes):
+    # Ensure result is in the correct format
+    if not isinstance(result, (list, tuple)):
+        return result
+
+    car_info = {
+        "year": str(result[0]) if len(result) > 0 else "Unknown",
+        "make": str(result[1]) if len(result) > 1 else "Unknown",
+        "model": str(result[2]) if len(result) > 2 else "Unknown",
+        "color": str(result[3]) if len(result) > 3 else "Unknown",
+        # "x1": result[4] if len(result) > 4 else "Unknown", # bounding boxes not yet implemented
+        # "y1": result[5] if len(result) > 5 else "Unknown", # bounding boxes not yet implemented
+        # "x2": result[6] if len(result) > 6 else "Unknown", # bounding boxes not yet implemented
+        # "y2": result[7] if len(result) > 7 else "Unknown", # bounding boxes not yet implemented
+    }
+    car_info.update(image_sizes)
+    return car_info
+
+
+def _prepare(image_bytes):
+    # the model gets a downsampled, recompressed copy; the original is what gets archived
+    try:
+        return prepare_for_model(image_bytes)
+    except Exception as e:
+        print(f"Could not preprocess image, sending original: {e}")
+        return image_bytes, {"original_bytes": len(image_bytes)}
+
+
+def _remember_upload(image_bytes, model_bytes, result, image_sizes):
+    # lets an exact re-upload skip preprocessing (the cache otherwise knows the prepared copy)
+    if result and not isinstance(result, Exception) and model_bytes is not image_bytes:
+        get_recognition_cache().store(
+            image_bytes, result, info=image_sizes, perceptual_hash=dhash(model_bytes)
+        )
+
+
+def identify_car(image_bytes, on_identified=None) -> dict:
+    # on_identified(year, make, model) is called as soon as the model has named the car
+    # an exact re-upload is answered before any decoding (counted as a cache hit, not timed)
+    cached = get_recognition_cache().lookup_exact(image_bytes)
+    if cached is not None:
+        result, image_sizes = cached
+        return _car_info_from(result, image_sizes or {"original_bytes": len(image_bytes)})
+
+    model_bytes, image_sizes = _prepare(image_bytes)
+    with time_stage("identify"):
+        if on_identified is None:
+            result = identify_vehicle_cached(model_bytes)  # skips the model for photos seen before
+        else:
+            result = identify_vehicle_cached(
+                model_bytes, identify=lambda data: identify_vehicle_streaming(data, on_identified)
+            )
+    _remember_upload(image_bytes, model_bytes, result, image_sizes)
+    return _car_info_from(result, image_sizes)
+
+
+def identify_cars(images) -> list:
+    # identify_car for several photos, sent to the model in batches. returns one entry per
+    # photo, in order: its car_info, or the exception it failed with
+    cache = get_recognition_cache()
+    cached = [cache.lookup_exact(image_bytes) for image_bytes in images]
+    misses = [index for index, entry in enumerate(cached) if entry is None]
+    prepared = {index: _prepare(images[index]) for index in misses}
+
+    results = []
+    if misses:
+        with time_stage("identify"):
+            results = identify_vehicles_cached([prepared[index][0] for index in misses])
+
+    car_infos = [None] * len(images)
+    for index, entry in enumerate(cached):
+        if entry is not None:
+            result, image_sizes = entry
+            car_infos[index] = _car_info_from(result, image_sizes or {"original_bytes": len(images[index])})
+    for index, result in zip(misses, results):
+        model_bytes, image_sizes = prepared[index]
+        _remember_upload(images[index], model_bytes, result, image_sizes)
+        car_infos[index] = result if isinstance(result, Exception) else _car_info_from(result, image_sizes)
+    return car_infos
+
+
+def add_car_stats(car_info: dict) -> dict:
+    with time_stage("stats_lookup"):
+        api_stats = lookup_car_stats(  # uses year, make, and model to fetch api_stats from Ninja Api (cached)
+            make=car_info.get("make", "Unknown"),
+            model=car_info.get("model", "Unknown"),
+            year=car_info.get("year", "Unknown"),
+        )
+    # remove year, make, and model from api_stats before merging with car_info
+    for key in ["year", "make", "model"]:
+        api_stats.pop(key, None)
+    car_info.update(api_stats)  # merge car_info and car_stats
+    return car_info
+
+
+def store_image(image_bytes):
+    # puts the photo in the image store and pre-generates its card thumbnail, so the gallery
+    # never decodes the full upload. returns (blob path, mime type)
+    with time_stage("image_write"):
+        blob_path, mime_type = put_image(image_bytes)  # deduplicated by content
+    try:
+        with time_stage("thumbnail"):
+            get_thumbnail(image_path_for(None, {"image": blob_path}))
+    except Exception:
+        release_image(blob_path)  # e.g. a corrupt upload: nothing will reference the blob
+        raise
+    return blob_path, mime_type
+
+
+def save_car(image_bytes, car_info: dict, stored_image=None) -> str:
+    # stores the image (unless store_image already did), records the car and returns the key
+    # it is stored under
+    entry_key = uuid.uuid4().hex
+    blob_path, mime_type = stored_image or store_image(image_bytes)
+    car_info["image"] = blob_path
+    car_info["mime_type"] = mime_type
+
+    with time_stage("metadata_save"):
+        get_store().add_car(entry_key, car_info)  # save car_info to disk
+    return entry_key
+
+
+def delete_car(entry_key: str):
+    store = get_store()
+    car_info = store.get_car(entry_key)
+    if car_info is None:
+        return
+    store.remove_car(entry_key)
+    if car_info.get("image"):
+        release_image(car_info["image"])
+
+
+def _prefetch_stats(year, make, model):
+    # called from the identify stream; add_car_stats later joins this lookup (or hits the
+    # cache it filled), and simply looks up again if the final answer names another car
+    _pipeline_pool.submit(lookup_car_stats, make=make, model=model, year=year)
+
+
+def _prerender_card(car_info):
+    from card import find_suitable_card_body
+
+    try:
+        find_suitable_card_body(image_path_for(None, car_info), car_info)
+    except Exception as e:
+        print(f"Could not pre-render card: {e}")
+
+
+def _discard_stored(stored):
+    # the upload failed after its photo was (being) stored
+    try:
+        blob_path, _ = stored.result()
+    except Exception:
+        return
+    release_image(blob_path)
+
+
+def process_image(image_bytes) -> dict:
+    # the whole pipeline for one photo; returns the saved car_info
+    stored = _pipeline_pool.submit(store_image, image_bytes)
+    card = None
+    try:
+        car_info = identify_car(image_bytes, on_identified=_prefetch_stats)
+        if not isinstance(car_info, dict):
+            raise ValueError("The car could not be identified")
+        add_car_stats(car_info)
+        stored_image = stored.result()
+
+        car_info["image"], car_info["mime_type"] = stored_image
+        card = _pipeline_pool.submit(_prerender_card, dict(car_info))
+        save_car(image_bytes, car_info, stored_image=stored_image)
+    except Exception:
+        if card is not None and not card.cancel():
+            card.result()  # let a running pre-render finish before its photo is released
+        _discard_stored(stored)
+        raise
+    card.result()
+    return car_info
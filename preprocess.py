@@ -0,0 +1,56 @@
+import os
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Shrinks uploads before they are sent to Gemini. Phone photos are often 5-12 MB, far more
+# than the model needs to recognize a car, so the image is rotated upright according to its
+# EXIF orientation, downsampled to a maximum edge and recompressed to fit a byte budget.
+# The original upload is still what gets archived in the collection.
+
+MODEL_IMAGE_MAX_EDGE = int(os.getenv("MODEL_IMAGE_MAX_EDGE", "1536"))
+MODEL_IMAGE_TARGET_BYTES = int(os.getenv("MODEL_IMAGE_TARGET_BYTES", str(400 * 1024)))
+
+_QUALITY_STEPS = (85, 75, 65, 55, 45)
+
+
+def _encode_jpeg(image, quality):
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    return buffered.getvalue()
+
+
+def prepare_for_model(
+    image_bytes, max_edge: int = MODEL_IMAGE_MAX_EDGE, target_bytes: int = MODEL_IMAGE_TARGET_BYTES
+):
+    # returns (jpeg_bytes, info) where info records the original and model payload sizes
+    with Image.open(BytesIO(image_bytes)) as image:
+        original_dimensions = image.size
+        # let the JPEG decoder downscale by a power of two while decoding (much cheaper than
+        # decoding at full size and resampling afterwards)
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    # step the quality down until the payload fits; if even the lowest quality is too large,
+    # keep halving the resolution
+    while True:
+        for quality in _QUALITY_STEPS:
+            data = _encode_jpeg(image, quality)
+            if len(data) <= target_bytes:
+                break
+        if len(data) <= target_bytes or min(image.size) <= 256:
+            break
+        image = image.resize((image.width // 2, image.height // 2), Image.Resampling.LANCZOS)
+
+    # never send more than the user uploaded
+    if len(data) >= len(image_bytes) and original_dimensions == image.size:
+        data = image_bytes
+
+    info = {
+        "original_bytes": len(image_bytes),
+        "upload_bytes": len(data),
+        "original_dimensions": f"{original_dimensions[0]}x{original_dimensions[1]}",
+        "upload_dimensions": f"{image.width}x{image.height}",
+    }
+    return data, info
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from tenacity import AsyncRetrying, Retrying, retry_if_exception_type, stop_after_attempt
+from metrics import API_BACKOFFS, API_CONCURRENCY_LIMIT
+
+# Client-side rate limiting for the external APIs (Gemini, api-ninjas), shared by every
+# Streamlit session, job worker and ingest thread in the process. Each API key gets a limiter
+# combining:
+#
+# - a token bucket: requests are spaced out to the key's quota (requests per minute), with
+#   short bursts of up to max concurrency requests
+# - an adaptive concurrency limit (AIMD): every successful request raises the limit by about
+#   one per round of requests, up to the max concurrency; a 429 or 5xx answer halves it
+# - Retry-After: when the API says how long to wait, no request goes out until then
+#
+# Overloaded requests are retried (with exponential backoff and full jitter, so the retries of
+# concurrent callers don't land together), at least as late as the API asked.
+
+RATE_LIMIT_RETRY_ATTEMPTS = int(os.getenv("RATE_LIMIT_RETRY_ATTEMPTS", "4"))
+# upper bound (seconds) of a single backoff, unless the API asks for longer
+RATE_LIMIT_MAX_BACKOFF = float(os.getenv("RATE_LIMIT_MAX_BACKOFF", "20"))
+
+
+class Overloaded(Exception):
+    # the API answered 429 or 5xx. raised inside limiter.limited() to back off
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds, if the API said
+
+
+def parse_retry_after(value):
+    # a Retry-After header (seconds, or an HTTP date) -> seconds to wait, or None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    def __init__(self, name, requests_per_minute, max_concurrency, burst=None, min_concurrency=1):
+        self.name = name
+        self.rate = requests_per_minute / 60  # tokens per second; 0 means no quota
+        self.burst = max(1, burst or max_concurrency)
+        self.max_concurrency = max(min_concurrency, max_concurrency)
+        self.min_concurrency = min_concurrency
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._waiters = []  # callables waking a blocked acquire
+        API_CONCURRENCY_LIMIT.labels(api=name).set(self._limit)
+
+    def _try_acquire(self):
+        # takes a concurrency slot; returns None if taken, else the seconds to wait before
+        # retrying (0 meaning: until a slot frees up)
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= int(self._limit):
+            return 0
+        self._in_flight += 1
+        return None
+
+    def _reserve_token(self):
+        # takes a token, possibly one that only refills later; returns the seconds until it does.
+        # tokens are handed out in call order, so waiting callers are served first come first served
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    def _wake_waiters(self):
+        with self._lock:
+            waiters, self._waiters = self._waiters, []
+        for wake in waiters:
+            wake()
+
+    def acquire(self):
+        # blocks until a request may go out; returns the time the slot was taken
+        while True:
+            with self._lock:
+                wait = self._try_acquire()
+                if wait is None:
+                    delay = self._reserve_token()
+                    break
+                woken = threading.Event()
+                self._waiters.append(woken.set)
+            woken.wait(timeout=wait or None)
+        if delay:
+            time.sleep(delay)
+        return time.monotonic()
+
+    async def acquire_async(self):
+        # acquire() for coroutines: waits without blocking the event loop
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                wait = self._try_acquire()
+                if wait is None:
+                    delay = self._reserve_token()
+                    break
+                woken = loop.create_future()
+                self._waiters.append(lambda: loop.call_soon_threadsafe(_set_done, woken))
+            await asyncio.wait((woken,), timeout=wait or None)
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except BaseException:  # cancelled while holding the slot
+                self.release(None, succeeded=False)
+                raise
+        return time.monotonic()
+
+    def release(self, started_at, overloaded=False, retry_after=None, succeeded=True):
+        with self._lock:
+            self._in_flight -= 1
+            if overloaded:
+                # halve once per wave of overload: requests started before the last decrease
+                # were sent at the old limit and say nothing about the new one
+                if started_at >= self._decreased_at:
+                    self._limit = max(self.min_concurrency, self._limit / 2)
+                    self._decreased_at = time.monotonic()
+                if retry_after:
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            elif succeeded:
+                self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+            limit = self._limit
+        API_CONCURRENCY_LIMIT.labels(api=self.name).set(limit)
+        self._wake_waiters()
+
+    def limited(self):
+        # `with limiter.limited():` (or `async with`) around one request; raise Overloaded
+        # inside to back off
+        return _Permit(self)
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Permit:
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = self.limiter.acquire()
+        return self
+
+    async def __aenter__(self):
+        self.started_at = await self.limiter.acquire_async()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if isinstance(exc, Overloaded):
+            API_BACKOFFS.labels(api=self.limiter.name).inc()
+            self.limiter.release(self.started_at, overloaded=True, retry_after=exc.retry_after)
+        else:
+            # other failures (bad request, network error) say nothing about load
+            self.limiter.release(self.started_at, succeeded=exc is None)
+        return False
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        return self.__exit__(exc_type, exc, traceback)
+
+
+def _backoff(retry_state):
+    # exponential backoff with full jitter, but never sooner than the API's Retry-After
+    attempt = retry_state.attempt_number
+    wait = random.uniform(0, min(RATE_LIMIT_MAX_BACKOFF, 0.5 * 2**attempt))
+    retry_after = getattr(retry_state.outcome.exception(), "retry_after", None)
+    return max(wait, retry_after or 0)
+
+
+def _retrying(retrying_class):
+    return retrying_class(
+        retry=retry_if_exception_type(Overloaded),
+        wait=_backoff,
+        stop=stop_after_attempt(RATE_LIMIT_RETRY_ATTEMPTS),
+        reraise=True,
+    )
+
+
+def call_limited(limiter, function, *args, **kwargs):
+    # function(*args, **kwargs) under the limiter, retried while it raises Overloaded. the last
+    # Overloaded is re-raised once the attempts run out
+    def attempt():
+        with limiter.limited():
+            return function(*args, **kwargs)
+
+    return _retrying(Retrying)(attempt)
+
+
+async def call_limited_async(limiter, function, *args, **kwargs):
+    # call_limited for a coroutine function
+    async def attempt():
+        async with limiter.limited():
+            return await function(*args, **kwargs)
+
+    return await _retrying(AsyncRetrying)(attempt)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(api, api_key, requests_per_minute, max_concurrency) -> RateLimiter:
+    # the process-wide limiter of one API key (quotas are per key, so keys don't share one).
+    # the settings only apply when the limiter is first created
+    key = (api, hashlib.sha256(api_key.encode()).hexdigest())
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(api, requests_per_minute, max_concurrency)
+        return limiter
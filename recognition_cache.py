@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import threading
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from core import identify_vehicle, identify_vehicles
+from config import COLLECTION_DIR
+from metrics import record_cache
+
+# Cache of identification results in front of core.identify_vehicle. Exact re-uploads are
+# matched by SHA-256, and re-saved/resized/recompressed copies of a photo are matched by a
+# perceptual difference hash (dHash) looked up in a BK-tree by Hamming distance.
+
+RECOGNITION_CACHE_FILE = os.path.join(COLLECTION_DIR, "recognition_cache.jsonl")
+
+# maximum number of differing dHash bits for two images to count as the same photo
+RECOGNITION_HASH_THRESHOLD = int(os.getenv("RECOGNITION_HASH_THRESHOLD", "4"))
+
+
+def dhash(image_bytes, hash_size: int = 8) -> int:
+    # 64-bit difference hash: downscale to (hash_size + 1) x hash_size greyscale and record
+    # whether each pixel is brighter than its right-hand neighbour
+    with Image.open(BytesIO(image_bytes)) as image:
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    # metric tree over Hamming distance: a lookup only descends into children whose edge
+    # distance lies within `threshold` of the query's distance to the node
+
+    def __init__(self):
+        self.root = None  # [hash, value, {distance: child}]
+
+    def add(self, key: int, value):
+        if self.root is None:
+            self.root = [key, value, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(key, node[0])
+            if distance == 0:
+                node[1] = value
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def nearest(self, key: int, threshold: int):
+        # returns (distance, value) of the closest entry within threshold, or None
+        if self.root is None:
+            return None
+        best = None
+        stack = [self.root]
+        while stack:
+            node_key, value, children = stack.pop()
+            distance = hamming_distance(key, node_key)
+            if distance <= threshold and (best is None or distance < best[0]):
+                best = (distance, value)
+                if distance == 0:
+                    break
+            for edge, child in children.items():
+                if distance - threshold <= edge <= distance + threshold:
+                    stack.append(child)
+        return best
+
+
+class RecognitionCache:
+    def __init__(self, cache_file=RECOGNITION_CACHE_FILE, threshold=RECOGNITION_HASH_THRESHOLD):
+        self.cache_file = cache_file
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._tree = BKTree()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        with open(self.cache_file, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a torn final line from an interrupted write
+                self._remember(entry["sha256"], entry["dhash"], tuple(entry["result"]), entry.get("info"))
+
+    def _remember(self, sha256, perceptual_hash, result, info=None):
+        self._exact[sha256] = (result, info)
+        self._tree.add(perceptual_hash, result)
+
+    def lookup_exact(self, image_bytes):
+        # returns (result, info) stored for exactly these bytes, or None. nothing is decoded, so
+        # this is the check to make before preparing an upload; misses aren't counted here
+        with self._lock:
+            entry = self._exact.get(hashlib.sha256(image_bytes).hexdigest())
+        if entry is not None:
+            record_cache("recognition", "exact_hit")
+        return entry
+
+    def lookup(self, image_bytes):
+        # returns the cached (year, make, model, color) tuple or None
+        sha256 = hashlib.sha256(image_bytes).hexdigest()
+        with self._lock:
+            entry = self._exact.get(sha256)
+        if entry is not None:
+            record_cache("recognition", "exact_hit")
+            return entry[0]
+
+        perceptual_hash = dhash(image_bytes)
+        with self._lock:
+            match = self._tree.nearest(perceptual_hash, self.threshold)
+        record_cache("recognition", "perceptual_hit" if match else "miss")
+        return match[1] if match else None
+
+    def store(self, image_bytes, result, info=None, perceptual_hash=None):
+        # info: extra details returned by lookup_exact. perceptual_hash defaults to the dHash
+        # of image_bytes; pass the hash of a smaller copy of the same photo to skip decoding
+        sha256 = hashlib.sha256(image_bytes).hexdigest()
+        if perceptual_hash is None:
+            perceptual_hash = dhash(image_bytes)
+        result = tuple(result)
+        with self._lock:
+            self._remember(sha256, perceptual_hash, result, info)
+            directory = os.path.dirname(self.cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.cache_file, "a") as f:
+                entry = {"sha256": sha256, "dhash": perceptual_hash, "result": list(result)}
+                if info is not None:
+                    entry["info"] = info
+                f.write(json.dumps(entry) + "\n")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_recognition_cache() -> RecognitionCache:
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = RecognitionCache()
+        return _default_cache
+
+
+def identify_vehicle_cached(image_bytes, identify=identify_vehicle):
+    # drop-in replacement for core.identify_vehicle that only calls the model on a cache miss
+    cache = get_recognition_cache()
+    result = cache.lookup(image_bytes)
+    if result is not None:
+        return result
+
+    result = identify(image_bytes)
+    if result:
+        cache.store(image_bytes, result)
+    return result
+
+
+def identify_vehicles_cached(images, identify_batch=identify_vehicles):
+    # batched identify_vehicle_cached: only the cache misses are sent to the model, together.
+    # returns one entry per image, in order: the result, or the exception that image failed with
+    cache = get_recognition_cache()
+    results = [cache.lookup(image_bytes) for image_bytes in images]
+    misses = [index for index, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+
+    for index, result in zip(misses, identify_batch([images[index] for index in misses])):
+        results[index] = result
+        if result and not isinstance(result, Exception):
+            cache.store(images[index], result)
+    return results
@@ -0,0 +1,368 @@
+import gc
+import heapq
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+from functools import lru_cache
+from collection_store import get_store
+
+# In-memory inverted index over the collection, used to filter the gallery. For every field
+# the cards show (make, model, year, drive, class, fuel type, color) it maps each value to the
+# set of row ids that have it, plus a word index over make and model for free-text search.
+# A filtered query intersects a handful of sets and only ever fetches the visible page from
+# the collection store.
+#
+# The index is built once per process (in the background, so it doesn't hold up the first
+# page) and then kept current by reading just the rows added since the last refresh
+# (uploads, bulk imports from other processes). If the row count no longer matches, cars
+# were removed and the index is rebuilt.
+#
+# Large collections are indexed from the Parquet snapshot (see snapshot.py) instead, column by
+# column and without parsing each car's JSON, and only the cars added since the snapshot are
+# read from the store. The snapshot is brought up to date after every such build.
+
+FIELDS = ("make", "model", "year", "drive", "class", "fuel_type", "color")
+_YEAR = FIELDS.index("year")
+
+# colors are indexed by the nearest of these, since no two photos give the same hex code
+COLOR_FAMILIES = {
+    "Black": (20, 20, 20),
+    "White": (245, 245, 245),
+    "Silver": (192, 192, 192),
+    "Gray": (120, 120, 120),
+    "Red": (190, 30, 30),
+    "Orange": (240, 130, 30),
+    "Yellow": (240, 210, 40),
+    "Green": (40, 130, 60),
+    "Blue": (30, 70, 190),
+    "Purple": (110, 50, 150),
+    "Brown": (110, 70, 40),
+    "Beige": (215, 195, 155),
+}
+
+_UNKNOWN = {"", "unknown", "none", "null", "n/a"}
+
+# collections at least this large are indexed from the snapshot; below that, reading pyarrow
+# costs more than it saves
+SEARCH_INDEX_SNAPSHOT_MIN_CARS = int(os.getenv("SEARCH_INDEX_SNAPSHOT_MIN_CARS", "5000"))
+
+
+_HEX_COLOR = re.compile(r"#?([0-9a-fA-F]{6})")
+
+
+@lru_cache(maxsize=65536)
+def color_family(color_code):
+    # "#C0C0C0" -> "Silver"; None for anything that isn't a hex color
+    match = _HEX_COLOR.fullmatch(str(color_code).strip())
+    if not match:
+        return None
+    value = int(match.group(1), 16)
+    r, g, b = value >> 16, (value >> 8) & 0xFF, value & 0xFF
+    best, best_distance = None, None
+    for name, (fr, fg, fb) in COLOR_FAMILIES.items():
+        distance = (r - fr) ** 2 + (g - fg) ** 2 + (b - fb) ** 2
+        if best_distance is None or distance < best_distance:
+            best, best_distance = name, distance
+    return best
+
+
+def color_families(color_codes):
+    # color_family of many color codes at once, matched against the palette with numpy
+    import numpy as np
+
+    names = list(COLOR_FAMILIES)
+    palette = np.array(list(COLOR_FAMILIES.values()), dtype=np.int64)
+    matches = [_HEX_COLOR.fullmatch(str(code).strip()) for code in color_codes]
+    values = np.array([int(match.group(1), 16) if match else 0 for match in matches], dtype=np.int64)
+    rgb = np.stack([values >> 16, (values >> 8) & 0xFF, values & 0xFF], axis=1)
+    nearest = ((rgb[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    return [names[index] if match else None for index, match in zip(nearest.tolist(), matches)]
+
+
+def _words(text):
+    return re.findall(r"[0-9a-z]+", str(text).lower())
+
+
+def _field_values(car_info):
+    # returns {field: (normalized value, display label)} for the fields this car has
+    values = {}
+    for field in FIELDS:
+        raw = car_info.get(field)
+        if raw is None:
+            continue
+        label = " ".join(str(raw).split())
+        value = label.lower()
+        if value in _UNKNOWN:
+            continue
+        if field == "year":
+            try:
+                values[field] = (int(value), int(value))
+            except ValueError:
+                pass
+        elif field == "color":
+            family = color_family(value)
+            if family:
+                values[field] = (family.lower(), family)
+        else:
+            values[field] = (value, label)
+    return values
+
+
+class SearchIndex:
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._postings = {field: {} for field in FIELDS}  # field -> value -> {row id}
+        self._labels = {field: {} for field in FIELDS}  # field -> value -> display label
+        self._word_postings = {}  # word -> {row id}
+        self._vocabulary = []  # sorted words, for prefix matches
+        self._docs = {}  # row id -> (value or None per field in FIELDS, words), to undo an add
+        self._last_id = 0
+
+    def _add(self, car_id, car_info):
+        if car_id in self._docs:
+            self._remove(car_id)
+        values = _field_values(car_info)
+        for field, (value, label) in values.items():
+            self._postings[field].setdefault(value, set()).add(car_id)
+            self._labels[field].setdefault(value, label)
+
+        words = set(_words(car_info.get("make", "")) + _words(car_info.get("model", "")))
+        for word in words:
+            postings = self._word_postings.get(word)
+            if postings is None:
+                postings = self._word_postings[word] = set()
+                insort(self._vocabulary, word)
+            postings.add(car_id)
+
+        self._docs[car_id] = (tuple(values[field][0] if field in values else None for field in FIELDS), words)
+        self._last_id = max(self._last_id, car_id)
+
+    def _remove(self, car_id):
+        values, words = self._docs.pop(car_id)
+        for field, value in zip(FIELDS, values):
+            if value is None:
+                continue
+            postings = self._postings[field][value]
+            postings.discard(car_id)
+            if not postings:
+                del self._postings[field][value]
+                del self._labels[field][value]
+        for word in words:
+            postings = self._word_postings[word]
+            postings.discard(car_id)
+            if not postings:
+                del self._word_postings[word]
+                del self._vocabulary[bisect_left(self._vocabulary, word)]
+
+    def load_snapshot(self, table):
+        # indexes a snapshot table (columns id and FIELDS) in place of the rows it covers. cars
+        # removed since the snapshot was taken are left out; refresh() then adds the newer ones
+        import numpy as np
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        with self._lock:
+            self._reset()
+            table = table.filter(pc.is_in(table["id"], value_set=pa.array(self.store.car_ids(), pa.int64())))
+            ids = table["id"].to_numpy()
+            if not len(ids):
+                return
+
+            def grouped(codes, count):
+                # row ids per code 0..count-1; rows with code -1 are in no group
+                order = np.argsort(codes, kind="stable")
+                bounds = np.searchsorted(codes[order], np.arange(count + 1))
+                return [ids[order[bounds[code] : bounds[code + 1]]].tolist() for code in range(count)]
+
+            row_values = []  # per field, each row's normalized value (or None)
+            row_words = []  # for make and model, each row's words
+            for field in FIELDS:
+                encoded = table[field].combine_chunks().dictionary_encode()
+                raw_codes = pc.fill_null(encoded.indices, -1).to_numpy(zero_copy_only=False)
+                raw_values = encoded.dictionary.to_pylist()
+                # each distinct raw value is normalized once, then rows are grouped by normalized
+                # value (different raw values, like most color codes, may share one)
+                if field == "color":
+                    normalized = [(family.lower(), family) if family else None for family in color_families(raw_values)]
+                else:
+                    normalized = [_field_values({field: raw}).get(field) for raw in raw_values]
+                value_codes = {}
+                for value_label in normalized:
+                    if value_label is not None:
+                        value, label = value_label
+                        value_codes.setdefault(value, len(value_codes))
+                        self._labels[field].setdefault(value, label)
+                codes = np.array(
+                    [value_codes[value_label[0]] if value_label else -1 for value_label in normalized] + [-1]
+                )[raw_codes]
+                for value, members in zip(value_codes, grouped(codes, len(value_codes))):
+                    self._postings[field][value] = set(members)
+                values = list(value_codes) + [None]
+                row_values.append([values[code] for code in codes.tolist()])  # code -1: no value
+
+                if field in ("make", "model"):
+                    words = [frozenset(_words(raw)) for raw in raw_values] + [frozenset()]
+                    for value_words, members in zip(words, grouped(raw_codes, len(raw_values))):
+                        for word in value_words:
+                            self._word_postings.setdefault(word, set()).update(members)
+                    row_words.append([words[code] for code in raw_codes.tolist()])
+            self._vocabulary = sorted(self._word_postings)
+
+            words = map(frozenset.union, *row_words)
+            self._docs = dict(zip(ids.tolist(), zip(zip(*row_values), words)))
+            self._last_id = int(ids.max())
+
+    def refresh(self):
+        # picks up cars added since the last refresh; rebuilds if any were removed
+        with self._lock:
+            for car_id, _, car_info in self.store.cars_since(self._last_id):
+                self._add(car_id, car_info)
+            if len(self._docs) != self.store.count_cars():
+                self._reset()
+                for car_id, _, car_info in self.store.cars_since(0):
+                    self._add(car_id, car_info)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def options(self, field, within=None):
+        # [(value, label)] present in the collection (or among the `within` filters' matches)
+        with self._lock:
+            values = self._postings[field]
+            if within:
+                ids = self._match(within)
+                values = {value: postings for value, postings in values.items() if postings & ids}
+            return sorted(((value, self._labels[field][value]) for value in values), key=lambda item: item[0])
+
+    def year_range(self):
+        with self._lock:
+            years = self._postings["year"]
+            return (min(years), max(years)) if years else None
+
+    def _match(self, filters=None, year_min=None, year_max=None, text=""):
+        # the set of row ids matching every given condition. filters: {field: [values]}, where
+        # a car matches a field if it has any of the listed values
+        candidates = []
+        for field, wanted in (filters or {}).items():
+            if wanted:
+                postings = self._postings[field]
+                if len(wanted) == 1:
+                    candidates.append(postings.get(wanted[0], set()))  # read only, no copy needed
+                else:
+                    candidates.append(set().union(*(postings.get(value, ()) for value in wanted)))
+
+        for word in _words(text):
+            # every query word must match the start of a make or model word
+            start = bisect_left(self._vocabulary, word)
+            matched = set()
+            for vocabulary_word in self._vocabulary[start:]:
+                if not vocabulary_word.startswith(word):
+                    break
+                matched |= self._word_postings[vocabulary_word]
+            candidates.append(matched)
+
+        if year_min is not None or year_max is not None:
+            low = year_min if year_min is not None else float("-inf")
+            high = year_max if year_max is not None else float("inf")
+            if candidates:
+                # cheaper to check the year of the few cars left than to union the year sets
+                docs = self._docs
+                year_filter = lambda car_id: docs[car_id][0][_YEAR] is not None and low <= docs[car_id][0][_YEAR] <= high
+            else:
+                years = self._postings["year"]
+                candidates.append(set().union(*(ids for year, ids in years.items() if low <= year <= high)))
+                year_filter = None
+        else:
+            year_filter = None
+
+        if not candidates:
+            return set(self._docs)
+        candidates.sort(key=len)  # intersect starting from the most selective condition
+        ids = candidates[0].intersection(*candidates[1:])
+        if year_filter is not None:
+            ids = set(filter(year_filter, ids))
+        return ids
+
+    def search(self, filters=None, year_min=None, year_max=None, text="", limit=None, offset=0):
+        # returns (number of matches, [row ids of the requested page, newest first])
+        with self._lock:
+            ids = self._match(filters, year_min, year_max, text)
+            last_id = self._last_id
+        if limit is None:
+            return len(ids), sorted(ids, reverse=True)[offset:]
+
+        wanted = offset + limit
+        if ids and wanted * last_id / len(ids) < len(ids):
+            # dense match: walking down from the newest row id finds the page in fewer steps
+            # than selecting the largest ids out of the whole match
+            page = []
+            for car_id in range(last_id, 0, -1):
+                if car_id in ids:
+                    page.append(car_id)
+                    if len(page) == wanted:
+                        break
+            return len(ids), page[offset:]
+        return len(ids), heapq.nlargest(wanted, ids)[offset:]
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+_default_index_ready = threading.Event()
+
+
+def _load_snapshot(index):
+    from snapshot import read_snapshot
+
+    try:
+        table = read_snapshot(columns=["id", *FIELDS])
+        if table is not None:
+            # the build allocates a few objects per car and no cycles; pausing the collector
+            # meanwhile halves its time on a large collection
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                index.load_snapshot(table)
+            finally:
+                if gc_enabled:
+                    gc.enable()
+    except Exception as e:
+        print(f"Could not load the search index from the snapshot: {e}")
+        with index._lock:
+            index._reset()  # refresh() indexes the whole collection instead
+
+
+def _build_default_index():
+    use_snapshot = False
+    try:
+        use_snapshot = _default_index.store.count_cars() >= SEARCH_INDEX_SNAPSHOT_MIN_CARS
+        if use_snapshot:
+            _load_snapshot(_default_index)
+        _default_index.refresh()
+    finally:
+        _default_index_ready.set()  # on failure, the next refresh() retries the build
+    if use_snapshot:
+        from snapshot import append_snapshot
+
+        append_snapshot(_default_index.store)  # so the next start finds the cars added since
+
+
+def get_search_index(wait=True):
+    # process-wide index over the default store, brought up to date on every call. a large
+    # collection takes seconds to index, so with wait=False the first build runs in the
+    # background and None is returned until it's done
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = SearchIndex()
+            threading.Thread(target=_build_default_index, name="search-index-build", daemon=True).start()
+    if not _default_index_ready.is_set():
+        if not wait:
+            return None
+        _default_index_ready.wait()
+    _default_index.refresh()
+    return _default_index
@@ -0,0 +1,200 @@
+import argparse
+import os
+import re
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collection_store import get_store
+from config import COLLECTION_DIR
+
+# Columnar snapshot of the collection, for analytics, backups and warm starts. Every car is
+# one row with a fixed schema (SNAPSHOT_SCHEMA), whatever shape its api-ninjas stats came in,
+# so the snapshot can be read with pandas, DuckDB or pyarrow without parsing any JSON.
+#
+# The snapshot is a directory of Parquet segments named by the range of row ids they cover.
+# Appending writes the cars added since the last segment as a new segment; compaction rewrites
+# the whole collection as a single segment, which also drops cars removed since. Appends
+# compact automatically once there are more than SNAPSHOT_MAX_SEGMENTS segments.
+#
+#     python snapshot.py append
+#     python snapshot.py compact
+#     python snapshot.py export collection.parquet   # one file, e.g. for a backup
+
+SNAPSHOT_DIR = os.path.join(COLLECTION_DIR, "snapshot")
+SNAPSHOT_MAX_SEGMENTS = int(os.getenv("SNAPSHOT_MAX_SEGMENTS", "16"))
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("key", pa.string()),
+        ("image", pa.string()),
+        ("year", pa.int32()),
+        ("make", pa.string()),
+        ("model", pa.string()),
+        ("color", pa.string()),
+        ("drive", pa.string()),
+        ("class", pa.string()),
+        ("fuel_type", pa.string()),
+        ("transmission", pa.string()),
+        ("cylinders", pa.int32()),
+        ("displacement", pa.float64()),
+        ("city_mpg", pa.int32()),
+        ("highway_mpg", pa.int32()),
+        ("combination_mpg", pa.int32()),
+    ]
+)
+
+_SEGMENT_NAME = re.compile(r"segment-(\d+)-(\d+)\.parquet")
+
+_snapshot_lock = threading.Lock()
+
+
+def _as_int(value):
+    # api-ninjas answers "premium subscribers only" and the like for some fields
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_str(value):
+    if value is None:
+        return None
+    return str(value)
+
+
+_CONVERTERS = {
+    pa.int32(): _as_int,
+    pa.int64(): _as_int,
+    pa.float64(): _as_float,
+    pa.string(): _as_str,
+}
+
+
+def snapshot_table(cars) -> pa.Table:
+    # cars: [(id, key, car_info)] as returned by CollectionStore.cars_since
+    cars = list(cars)
+    columns = {
+        "id": [car_id for car_id, _, _ in cars],
+        "key": [key for _, key, _ in cars],
+    }
+    for field in SNAPSHOT_SCHEMA:
+        if field.name not in columns:
+            convert = _CONVERTERS[field.type]
+            columns[field.name] = [convert(car_info.get(field.name)) for _, _, car_info in cars]
+    return pa.table(columns, schema=SNAPSHOT_SCHEMA)
+
+
+def _segment_files(directory):
+    # returns [(first id, last id, path)] of every segment in the directory
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    segments = []
+    for name in names:
+        match = _SEGMENT_NAME.fullmatch(name)
+        if match:
+            segments.append((int(match.group(1)), int(match.group(2)), os.path.join(directory, name)))
+    return segments
+
+
+def _segments(directory):
+    # the segments to read, oldest first. a compacted segment covers the ones it replaced, which
+    # may still be around while a compaction runs (or after one was interrupted), so covered
+    # segments are left out
+    segments = []
+    for first, last, path in sorted(_segment_files(directory), key=lambda segment: (segment[0], -segment[1])):
+        if segments and last <= segments[-1][1]:
+            continue
+        segments.append((first, last, path))
+    return segments
+
+
+def _write_segment(directory, table, first, last):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"segment-{first:012d}-{last:012d}.parquet")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+    return path
+
+
+def snapshot_last_id(directory=SNAPSHOT_DIR) -> int:
+    # the newest row id in the snapshot, 0 if there is none
+    segments = _segments(directory)
+    return segments[-1][1] if segments else 0
+
+
+def read_snapshot(directory=SNAPSHOT_DIR, columns=None):
+    # the snapshot as one table (oldest car first), or None if there is none
+    segments = _segments(directory)
+    if not segments:
+        return None
+    tables = [pq.read_table(path, columns=columns, memory_map=True) for _, _, path in segments]
+    return pa.concat_tables(tables)
+
+
+def compact_snapshot(store=None, directory=SNAPSHOT_DIR) -> int:
+    # rewrites the snapshot as a single segment of the current collection. returns its row count
+    store = store or get_store()
+    with _snapshot_lock:
+        cars = store.cars_since(0)
+        replaced = _segment_files(directory)
+        compacted = _write_segment(directory, snapshot_table(cars), 1, cars[-1][0]) if cars else None
+        for _, _, path in replaced:
+            if path != compacted:
+                os.remove(path)
+        return len(cars)
+
+
+def append_snapshot(store=None, directory=SNAPSHOT_DIR) -> int:
+    # writes the cars added since the last segment as a new segment. returns the rows written
+    store = store or get_store()
+    with _snapshot_lock:
+        segments = _segments(directory)
+        last_id = segments[-1][1] if segments else 0
+        cars = store.cars_since(last_id)
+        if not cars:
+            return 0
+        _write_segment(directory, snapshot_table(cars), last_id + 1, cars[-1][0])
+        compact = len(segments) + 1 > SNAPSHOT_MAX_SEGMENTS
+    if compact:
+        compact_snapshot(store, directory)
+    return len(cars)
+
+
+def export_snapshot(path, store=None):
+    # the whole collection as a single Parquet file. returns the row count
+    store = store or get_store()
+    table = snapshot_table(store.cars_since(0))
+    pq.write_table(table, path, compression="zstd")
+    return table.num_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the collection to Parquet.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("append", help="snapshot the cars added since the last snapshot")
+    subcommands.add_parser("compact", help="rewrite the snapshot as a single segment")
+    export = subcommands.add_parser("export", help="write the whole collection to one file")
+    export.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "append":
+        print(f"Appended {append_snapshot()} cars to {SNAPSHOT_DIR}")
+    elif args.command == "compact":
+        print(f"Compacted {SNAPSHOT_DIR} into one segment of {compact_snapshot()} cars")
+    else:
+        print(f"Exported {export_snapshot(args.path)} cars to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import difflib
+import os
+import re
+import sys
+import threading
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+# Offline vehicle-spec index consulted before the api-ninjas request in stats_cache. Specs are
+# read from a columnar dataset with the same fields the stats API returns (year, make, model,
+# drive, class, cylinders, displacement, fuel_type, city_mpg, highway_mpg, ...). The whole
+# table is loaded into memory as Arrow columns. Only make, model and year are turned into
+# Python objects up front (for the lookup dict); a row's other specs are converted the first
+# time it is looked up.
+#
+# Build the Parquet file from a CSV export once:
+#
+#     python spec_index.py build vehicle_specs.csv data/vehicle_specs.parquet
+
+SPEC_INDEX_PATH = os.getenv("SPEC_INDEX_PATH", os.path.join("data", "vehicle_specs.parquet"))
+
+# how far the identified year may be from the closest year in the dataset
+SPEC_INDEX_YEAR_TOLERANCE = int(os.getenv("SPEC_INDEX_YEAR_TOLERANCE", "1"))
+# minimum similarity (0-1) for fuzzy make/model matches
+SPEC_INDEX_FUZZY_CUTOFF = float(os.getenv("SPEC_INDEX_FUZZY_CUTOFF", "0.85"))
+
+REQUIRED_COLUMNS = ("year", "make", "model")
+
+
+def normalize_name(name) -> str:
+    # "Mercedes-Benz" -> "mercedesbenz", "F-150 " -> "f150": absorbs the capitalization,
+    # spacing and punctuation drift of LLM answers
+    return re.sub(r"[^0-9a-z]", "", str(name).lower())
+
+
+def _to_int_year(year):
+    try:
+        return int(str(year).strip()[:4])
+    except ValueError:
+        return None
+
+
+class SpecIndex:
+    def __init__(self, table: pa.Table):
+        missing = [c for c in REQUIRED_COLUMNS if c not in table.column_names]
+        if missing:
+            raise ValueError(f"Spec dataset is missing columns: {', '.join(missing)}")
+
+        self.table = table
+        self._materialized = {}  # row -> dict, for rows that have been looked up before
+        # {normalized make: {normalized model: {year: row}}}
+        self._rows = {}
+        makes = table.column("make").to_pylist()
+        models = table.column("model").to_pylist()
+        years = pc.cast(table.column("year"), pa.string()).to_pylist()
+        for row, (make, model, year) in enumerate(zip(makes, models, years)):
+            year = _to_int_year(year)
+            if year is None:
+                continue
+            by_year = self._rows.setdefault(normalize_name(make), {}).setdefault(
+                normalize_name(model), {}
+            )
+            by_year.setdefault(year, row)  # first row (base trim) wins
+
+    @classmethod
+    def load(cls, path: str):
+        if path.endswith(".csv"):
+            table = pa_csv.read_csv(path)
+        else:
+            table = pq.read_table(path)
+        return cls(table)
+
+    def _match(self, name, candidates):
+        if name in candidates:
+            return name
+        matches = difflib.get_close_matches(name, candidates, n=1, cutoff=SPEC_INDEX_FUZZY_CUTOFF)
+        return matches[0] if matches else None
+
+    def lookup(self, make: str, model: str, year: str):
+        # returns the spec row as a dict (same shape as an api-ninjas result), or None
+        year = _to_int_year(year)
+        if year is None:
+            return None
+
+        make_key = self._match(normalize_name(make), self._rows)
+        if make_key is None:
+            return None
+        models = self._rows[make_key]
+        model_key = self._match(normalize_name(model), models)
+        if model_key is None:
+            return None
+
+        by_year = models[model_key]
+        closest = min(by_year, key=lambda y: abs(y - year))
+        if abs(closest - year) > SPEC_INDEX_YEAR_TOLERANCE:
+            return None
+
+        row = by_year[closest]
+        specs = self._materialized.get(row)
+        if specs is None:
+            # null cells are left out, so callers see them as missing like any absent field
+            specs = self._materialized[row] = {
+                field: value for field, value in self.table.slice(row, 1).to_pylist()[0].items() if value is not None
+            }
+        return dict(specs)  # callers pop keys from the result
+
+
+_index = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_spec_index():
+    # process-wide index, loaded on first use. None when no dataset is installed
+    global _index, _index_loaded
+    with _index_lock:
+        if not _index_loaded:
+            _index_loaded = True
+            if os.path.exists(SPEC_INDEX_PATH):
+                try:
+                    _index = SpecIndex.load(SPEC_INDEX_PATH)
+                except Exception as e:
+                    print(f"Could not load spec index {SPEC_INDEX_PATH}: {e}")
+        return _index
+
+
+def lookup_local_specs(make: str, model: str, year: str):
+    index = get_spec_index()
+    if index is None:
+        return None
+    return index.lookup(make=make, model=model, year=year)
+
+
+def build_index_file(csv_path: str, parquet_path: str):
+    # converts a CSV spec dump to Parquet, sorted so rows of the same make/model sit together
+    table = pa_csv.read_csv(csv_path)
+    table = table.sort_by([("make", "ascending"), ("model", "ascending"), ("year", "ascending")])
+    directory = os.path.dirname(parquet_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    pq.write_table(table, parquet_path)
+    print(f"Wrote {table.num_rows} specs to {parquet_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print("usage: python spec_index.py build <specs.csv> <specs.parquet>")
+        sys.exit(1)
+    build_index_file(sys.argv[2], sys.argv[3])
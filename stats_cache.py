@@ -0,0 +1,109 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from core import request_car_stats
+from config import COLLECTION_DIR
+from metrics import record_cache
+from spec_index import lookup_local_specs
+
+# Caching layer over core.request_car_stats. The offline spec index (spec_index.py) is
+# consulted first; if it has no match, results are cached on disk keyed by the
+# normalized (year, make, model), "no such car" answers are cached too (for a shorter time) so
+# they aren't retried on every upload, and concurrent lookups of the same car share a single
+# in-flight request.
+
+STATS_CACHE_DIR = os.path.join(COLLECTION_DIR, ".stats_cache")
+
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", str(30 * 24 * 3600)))  # 30 days
+STATS_NEGATIVE_CACHE_TTL = int(os.getenv("STATS_NEGATIVE_CACHE_TTL", str(24 * 3600)))  # 1 day
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def normalize_stats_key(make: str, model: str, year: str):
+    # the model's capitalization and spacing drift between identifications of the same car
+    return (
+        " ".join(str(year).split()),
+        " ".join(str(make).split()).lower(),
+        " ".join(str(model).split()).lower(),
+    )
+
+
+def _cache_path(key):
+    digest = hashlib.sha1("|".join(key).encode()).hexdigest()
+    return os.path.join(STATS_CACHE_DIR, f"{digest}.json")
+
+
+def _read_cached(key):
+    try:
+        with open(_cache_path(key), "r") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    ttl = STATS_CACHE_TTL if entry["stats"] else STATS_NEGATIVE_CACHE_TTL
+    if time.time() - entry["fetched_at"] > ttl:
+        return None
+    return entry
+
+
+def _write_cached(key, stats):
+    os.makedirs(STATS_CACHE_DIR, exist_ok=True)
+    path = _cache_path(key)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"key": list(key), "fetched_at": time.time(), "stats": stats}, f)
+    os.replace(tmp_path, path)
+
+
+def _fetch(key, make, model, year):
+    entry = _read_cached(key)
+    if entry is not None:
+        record_cache("stats", "hit" if entry["stats"] else "negative_hit")
+        return entry["stats"]
+    record_cache("stats", "miss")
+
+    matches = request_car_stats(make=make, model=model, year=year)
+    if matches is None:
+        return {}  # request failed: don't cache, the next upload will retry
+
+    stats = matches[0] if matches else {}
+    if not stats:
+        print(
+            "Stat API request succeeded, but returned empty. (make, model, and year not recognized)"
+        )
+    _write_cached(key, stats)
+    return stats
+
+
+def lookup_car_stats(make: str, model: str, year: str) -> dict:
+    # cached, coalesced equivalent of core.get_car_stats
+    local_specs = lookup_local_specs(make=make, model=model, year=year)
+    record_cache("spec_index", "hit" if local_specs else "miss")
+    if local_specs:
+        return local_specs
+
+    key = normalize_stats_key(make, model, year)
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    if leader:
+        try:
+            future.set_result(_fetch(key, make, model, year))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _in_flight_lock:
+                del _in_flight[key]
+
+    # callers mutate the returned dict (e.g. popping year/make/model), so hand out copies
+    return copy.deepcopy(future.result())
@@ -0,0 +1,177 @@
+import os
+import shutil
+import threading
+from urllib.parse import urlparse
+from config import COLLECTION_DIR
+
+# Where the collection's images and metadata changes are kept. By default that is the local
+# collection directory and nothing else happens. To run several app replicas on one collection,
+# point every replica at the same shared storage:
+#
+#     STORAGE_URL=s3://my-bucket/trading-cars    S3 or any S3-compatible store (set
+#                                                S3_ENDPOINT_URL for MinIO, moto_server, ...)
+#     STORAGE_URL=file:///mnt/shared/collection  a directory on a volume all replicas mount
+#
+# With shared storage, each replica keeps its SQLite database and the images it has used as a
+# local copy (see collection_store.py and image_store.py); the shared storage is the source
+# of truth. Keys are "/"-separated paths, like "images/3f/a2/3fa2...e9.jpg".
+
+STORAGE_URL = os.getenv("STORAGE_URL")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+
+
+class PreconditionFailed(Exception):
+    # a create_only write found the key already taken (by another replica)
+    pass
+
+
+class LocalStorage:
+    def __init__(self, root, shared=False):
+        self.root = root
+        self.shared = shared  # True when other replicas use the same directory
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def get(self, key) -> bytes:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def put(self, key, data, create_only=False):
+        # atomic: readers see either the old object, no object, or the complete new one
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if not create_only:
+            os.replace(tmp_path, path)
+            return
+        try:
+            os.link(tmp_path, path)  # unlike a rename, fails if the key already exists
+        except FileExistsError:
+            raise PreconditionFailed(key) from None
+        finally:
+            os.remove(tmp_path)
+
+    def exists(self, key) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix, start_after=""):
+        # keys under the "/"-terminated prefix, in lexicographic order, after start_after
+        directory = self._path(prefix.rstrip("/"))
+        if not os.path.isdir(directory):
+            return []
+        keys = (
+            f"{prefix}{name}"
+            for name in os.listdir(directory)
+            if not name.endswith(".tmp") and os.path.isfile(os.path.join(directory, name))
+        )
+        return sorted(key for key in keys if key > start_after)
+
+    def download(self, key, path):
+        try:
+            shutil.copyfile(self._path(key), path)
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+
+class S3Storage:
+    shared = True
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("S3 storage requires boto3 (pip install boto3)") from None
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = f"{prefix.strip('/')}/" if prefix.strip("/") else ""
+        self._client = client
+
+    def _error_code(self, error):
+        return error.response.get("Error", {}).get("Code") if hasattr(error, "response") else None
+
+    def get(self, key) -> bytes:
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self._client.exceptions.NoSuchKey:
+            raise KeyError(key) from None
+        return response["Body"].read()
+
+    def put(self, key, data, create_only=False):
+        # create_only maps to a conditional write (If-None-Match: *), which S3 resolves atomically
+        extra = {"IfNoneMatch": "*"} if create_only else {}
+        try:
+            self._client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, **extra)
+        except self._client.exceptions.ClientError as e:
+            if self._error_code(e) in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409"):
+                raise PreconditionFailed(key) from None
+            raise
+
+    def exists(self, key) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self._client.exceptions.ClientError as e:
+            if self._error_code(e) in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def delete(self, key):
+        self._client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list(self, prefix, start_after=""):
+        # keys under prefix, in lexicographic order, after start_after
+        keys = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket,
+            Prefix=self.prefix + prefix,
+            StartAfter=self.prefix + start_after if start_after else "",
+        )
+        for page in pages:
+            keys.extend(item["Key"][len(self.prefix) :] for item in page.get("Contents", ()))
+        return keys
+
+    def download(self, key, path):
+        data = self.get(key)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def storage_from_url(url):
+    # None -> the local collection directory, unshared
+    if not url:
+        return LocalStorage(COLLECTION_DIR)
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        return S3Storage(parsed.netloc, parsed.path, endpoint_url=S3_ENDPOINT_URL)
+    if parsed.scheme == "file":
+        return LocalStorage(parsed.path, shared=True)
+    raise ValueError(f"Unsupported STORAGE_URL: {url!r}")
+
+
+_default_storage = None
+_default_storage_lock = threading.Lock()
+
+
+def get_storage():
+    # process-wide storage selected by STORAGE_URL
+    global _default_storage
+    with _default_storage_lock:
+        if _default_storage is None:
+            _default_storage = storage_from_url(STORAGE_URL)
+        return _default_storage
@@ -0,0 +1,55 @@
+import os
+import sys
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from card import build_card  # noqa: E402
+from spec_index import SpecIndex  # noqa: E402
+
+
+def test_null_cells_are_left_out():
+    table = pa.table(
+        {
+            "year": [2019],
+            "make": ["Porsche"],
+            "model": ["911"],
+            "drive": pa.array([None], pa.string()),
+            "fuel_type": pa.array([None], pa.string()),
+            "city_mpg": pa.array([None], pa.int64()),
+            "highway_mpg": pa.array([None], pa.int64()),
+            "cylinders": [6],
+        }
+    )
+    specs = SpecIndex(table).lookup(make="Porsche", model="911", year="2019")
+    assert specs == {"year": 2019, "make": "Porsche", "model": "911", "cylinders": 6}
+
+
+def test_car_with_null_specs_gets_a_basic_card(tmp_path, monkeypatch):
+    import thumbnails
+    from PIL import Image
+
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_DIR", str(tmp_path / ".thumbnails"))
+    image_path = str(tmp_path / "car.jpg")
+    Image.new("RGB", (64, 48), "red").save(image_path)
+    # every spec but the drivetrain is known
+    table = pa.table(
+        {
+            "year": [2019],
+            "make": ["Porsche"],
+            "model": ["911"],
+            "drive": pa.array([None], pa.string()),
+            "class": ["two seater"],
+            "cylinders": [6],
+            "displacement": [3.0],
+            "fuel_type": ["gas"],
+            "city_mpg": [18],
+            "highway_mpg": [24],
+        }
+    )
+    details = {"year": "2019", "make": "Porsche", "model": "911", "color": "#C0C0C0"}
+    details.update(SpecIndex(table).lookup(make="Porsche", model="911", year="2019"))
+    card_html = build_card(image_path, details)
+    assert card_html is not None
+    assert "with-specs" not in card_html
+    assert "drivetrain" not in card_html
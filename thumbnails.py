@@ -0,0 +1,150 @@
+import base64
+import hashlib
+import os
+import threading
+from io import BytesIO
+from config import COLLECTION_DIR
+from metrics import record_cache
+
+# Card-sized JPEG derivatives of collection images, generated once (at upload time or on
+# first access) and kept on disk next to the collection under an LRU size budget.
+
+THUMBNAIL_DIR = os.path.join(COLLECTION_DIR, ".thumbnails")
+
+# cards display images at 300x200 css px, so derivatives are rendered at 2x for hi-dpi screens
+CARD_THUMBNAIL_SIZE = (600, 400)
+THUMBNAIL_QUALITY = 85
+THUMBNAIL_BUDGET_BYTES = int(os.getenv("THUMBNAIL_BUDGET_MB", "256")) * 1024 * 1024
+
+_lock = threading.Lock()
+_cache_bytes = None  # running total of bytes on disk, computed lazily
+
+
+def _thumbnail_key(image_path, bbox, size):
+    # derivatives are keyed by source file, source version, crop and target size. the source
+    # is identified by mtime and size, so overwriting the image produces a fresh key
+    stat = os.stat(image_path)
+    raw = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{bbox}|{size[0]}x{size[1]}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _source_prefix(image_path):
+    # all derivatives of the same source image share this prefix, which lets us drop stale
+    # ones (old crop, old source version) as soon as a new derivative is created
+    return hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()[:16]
+
+
+def _valid_bbox(x1, y1, x2, y2):
+    if x1 and y1 and x2 and y2:
+        return (int(x1), int(y1), int(x2), int(y2))
+    return None
+
+
+def _render_thumbnail(image_path, bbox, size):
+    # imported here: with the thumbnails already on disk, serving the gallery never needs PIL
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as image:
+        if bbox:
+            image = image.crop(bbox)
+        # equivalent to the card's `object-fit: cover`, so nothing visible is lost
+        thumbnail = ImageOps.fit(image.convert("RGB"), size, Image.Resampling.LANCZOS)
+
+    buffered = BytesIO()
+    thumbnail.save(buffered, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return buffered.getvalue()
+
+
+def _directory_size():
+    total = 0
+    for entry in os.scandir(THUMBNAIL_DIR):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+def _enforce_budget():
+    # evict least recently used derivatives (by mtime, which is bumped on every hit)
+    global _cache_bytes
+    if _cache_bytes is None:
+        _cache_bytes = _directory_size()
+    if _cache_bytes <= THUMBNAIL_BUDGET_BYTES:
+        return
+
+    entries = [e for e in os.scandir(THUMBNAIL_DIR) if e.is_file()]
+    entries.sort(key=lambda e: e.stat().st_mtime_ns)
+    for entry in entries:
+        if _cache_bytes <= THUMBNAIL_BUDGET_BYTES:
+            break
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            _cache_bytes -= size
+        except FileNotFoundError:
+            continue
+
+
+def _remove_stale_derivatives(prefix, keep_name):
+    global _cache_bytes
+    for entry in os.scandir(THUMBNAIL_DIR):
+        if entry.name.startswith(prefix) and entry.name != keep_name:
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                if _cache_bytes is not None:
+                    _cache_bytes -= size
+            except FileNotFoundError:
+                continue
+
+
+def get_thumbnail(
+    image_path, x1: int = None, y1: int = None, x2: int = None, y2: int = None, size=CARD_THUMBNAIL_SIZE
+):
+    # returns the JPEG bytes of the card-sized derivative, generating it if needed
+    global _cache_bytes
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+
+    bbox = _valid_bbox(x1, y1, x2, y2)
+    prefix = _source_prefix(image_path)
+    name = f"{prefix}_{_thumbnail_key(image_path, bbox, size)}.jpg"
+    thumbnail_path = os.path.join(THUMBNAIL_DIR, name)
+
+    try:
+        with open(thumbnail_path, "rb") as f:
+            data = f.read()
+        os.utime(thumbnail_path)  # mark as recently used
+        record_cache("thumbnail", "hit")
+        return data
+    except FileNotFoundError:
+        record_cache("thumbnail", "miss")
+
+    data = _render_thumbnail(image_path, bbox, size)
+
+    # write to a temp file first so concurrent sessions never read a partial derivative
+    tmp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, thumbnail_path)
+
+    with _lock:
+        _remove_stale_derivatives(prefix, keep_name=name)
+        if _cache_bytes is not None:
+            _cache_bytes += len(data)
+        _enforce_budget()
+
+    return data
+
+
+def get_thumbnail_base64(
+    image_path, x1: int = None, y1: int = None, x2: int = None, y2: int = None, size=CARD_THUMBNAIL_SIZE
+):
+    data = get_thumbnail(image_path, x1=x1, y1=y1, x2=x2, y2=y2, size=size)
+    return f"data:image/jpeg;base64,{base64.b64encode(data).decode()}"
+
+
+def invalidate_thumbnails(image_path):
+    # drops every derivative of an image, e.g. when the image is deleted from the collection
+    if not os.path.isdir(THUMBNAIL_DIR):
+        return
+    with _lock:
+        _remove_stale_derivatives(_source_prefix(image_path), keep_name=None)